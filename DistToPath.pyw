@@ -1,14 +1,16 @@
 #!/usr/bin/env python3
 
-import wx
-from disttopath import frame
+import multiprocessing
 
 
 def main():
+    import wx
+    from disttopath import frame
     app = wx.App()
     mainframe = frame.Frame(None)
     mainframe.Show(True)
     app.MainLoop()
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
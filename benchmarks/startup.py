@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+""" Startup benchmark: measure the time it takes to import the modules
+    that a command-line session or a worker process needs, and check
+    that heavy optional modules are not imported along with them.
+
+    Usage: python benchmarks/startup.py [number of repeats]
+"""
+
+import os.path
+import subprocess
+import sys
+
+# Modules that should only be imported when actually needed
+HEAVY_MODULES = ('wx', 'openpyxl', 'numpy')
+
+# Entry points that must start without the heavy modules
+ENTRY_MODULES = ('disttopath.cli', 'disttopath.main', 'disttopath.core')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_time(module):
+    """ Return the cumulative import time of module in microseconds, as
+        reported by 'python -X importtime', and the list of top-level
+        packages that were imported.
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+                          cwd=ROOT, stderr=subprocess.PIPE, universal_newlines=True,
+                          check=True)
+    total = 0
+    imported = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        __, cumulative, name = [e.strip() for e in line[len('import time:'):].split('|')]
+        imported.add(name.split('.')[0])
+        if name == module:
+            total = int(cumulative)
+    return total, imported
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    failed = False
+    for module in ENTRY_MODULES:
+        times = []
+        imported = set()
+        for __ in range(repeats):
+            t, imported = import_time(module)
+            times.append(t)
+        heavy = sorted(imported.intersection(HEAVY_MODULES))
+        sys.stdout.write("%-20s best %7.1f ms  median %7.1f ms%s\n"
+                         % (module, min(times) / 1000, sorted(times)[len(times) // 2] / 1000,
+                            "  (imports %s!)" % ", ".join(heavy) if heavy else ""))
+        if heavy:
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
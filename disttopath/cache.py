@@ -0,0 +1,123 @@
+""" On-disk cache of processed profiles.
+
+    Entries are keyed by a hash of the contents of the input file and of
+    the options that affect the analysis of a profile, so that unchanged
+    input files need not be processed again in a later session. Output
+    options are not part of the key.
+
+    Note that a cache hit also reuses the points of any Monte Carlo
+    simulations.
+"""
+
+import hashlib
+import os
+import os.path
+import pickle
+import tempfile
+from . import file_io
+from . import version
+
+# Options that affect the processing of a single profile
+ANALYSIS_OPTIONS = ('spatial_resolution', 'shell_width', 'metric_unit', 'use_polarity',
+                    'use_random', 'determine_interpoint_dists', 'interpoint_dist_mode',
+                    'interpoint_relations', 'interpoint_shortest_dist',
+                    'interpoint_lateral_dist', 'determine_clusters', 'within_cluster_dist',
+                    'run_monte_carlo', 'monte_carlo_runs', 'monte_carlo_simulation_window')
+
+CACHE_FILE_EXT = '.cache'
+
+# Included in the cache key; bump when the cached profiles change, so that
+# older entries are not used
+CACHE_FORMAT = 2
+
+
+class ResultCache:
+    def __init__(self, cache_dir, max_size):
+        """ Cache entries in cache_dir, which is created if needed. When
+            evicting, keep at most max_size megabytes of entries.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size * 1024 * 1024
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    @staticmethod
+    def key(inputfn, opt):
+        """ Return the cache key of input file inputfn processed with
+            options opt, or None if the file could not be read.
+        """
+        h = hashlib.sha256()
+        h.update(version.version.encode('utf-8'))
+        h.update(("format=%d;" % CACHE_FORMAT).encode('utf-8'))
+        for optstr in ANALYSIS_OPTIONS:
+            val = getattr(opt, optstr)
+            if hasattr(val, 'items'):
+                val = sorted(val.items())
+            h.update(("%s=%r;" % (optstr, val)).encode('utf-8'))
+        try:
+            with file_io.open_input(inputfn, binary=True) as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+        except IOError:
+            return None
+        return h.hexdigest()
+
+    def __path(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_FILE_EXT)
+
+    def get(self, key):
+        """ Return the profile cached under key, or None if there is no
+            such (valid) entry.
+        """
+        fn = self.__path(key)
+        try:
+            with open(fn, 'rb') as f:
+                pro = pickle.load(f)
+            # Mark entry as recently used
+            os.utime(fn)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError, AttributeError,
+                ImportError, IndexError):
+            return None
+        return pro
+
+    def put(self, key, pro):
+        """ Store profile pro under key. Failure to write the entry is
+            silently ignored.
+        """
+        try:
+            fd, tmpfn = tempfile.mkstemp(dir=self.cache_dir)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(pro, f, pickle.HIGHEST_PROTOCOL)
+                os.replace(tmpfn, self.__path(key))
+            except BaseException:
+                os.remove(tmpfn)
+                raise
+        except (IOError, OSError, pickle.PicklingError):
+            pass
+
+    def evict(self):
+        """ Remove the least recently used entries until the cache is no
+            larger than max_size. Return the number of removed entries.
+        """
+        entries = []
+        for fn in os.listdir(self.cache_dir):
+            if not fn.endswith(CACHE_FILE_EXT):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, fn))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, fn))
+        total = sum(size for __, size, __ in entries)
+        n = 0
+        for __, size, fn in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, fn))
+                total -= size
+                n += 1
+            except OSError:
+                pass
+        return n
@@ -0,0 +1,224 @@
+""" Command-line batch runner for DistToPath.
+
+    Runs a session on the input files given on the command line, without
+    a graphical user interface (and without importing wx). Options are
+    read from a configuration file in the same format as the one saved
+    by the GUI, and may be overridden by command-line arguments. The log
+    is written to stdout.
+
+    Exit codes:
+      0  all input files were processed cleanly
+      1  an unexpected error occurred, or the results file given with
+         --reexport could not be read
+      2  invalid command line or no input files found
+      3  one or more input files could not be processed
+      4  all input files were processed, but with warnings
+      130  the session was interrupted
+"""
+
+import argparse
+import glob
+import os
+import os.path
+import sys
+from . import core
+from . import file_io
+from . import main as main_module
+from . import version
+
+EXIT_OK = 0
+EXIT_FAILURE = 1
+EXIT_USAGE = 2
+EXIT_ERRORS = 3
+EXIT_WARNINGS = 4
+EXIT_INTERRUPTED = 130
+
+# Exit codes corresponding to the return values of main.main_proc() and
+# main.reexport_proc()
+_exit_codes = {0: EXIT_ERRORS, 1: EXIT_OK, 2: EXIT_WARNINGS, 3: EXIT_INTERRUPTED,
+               4: EXIT_FAILURE}
+
+
+class NullQueue:
+    """ Stands in for the process queue of the GUI; progress events are
+        not needed, because the log already goes to stdout.
+    """
+    def put(self, item):
+        pass
+
+
+class BatchSession:
+    """ The 'parent' of main.main_proc() when running from the command
+        line.
+    """
+    def __init__(self, opt):
+        self.opt = opt
+        self.process_queue = NullQueue()
+
+
+def expand_input_files(patterns, exts):
+    """ Return a list of input files from a list of file names, glob
+        patterns and directories (from which all archives and all files
+        with an extension in exts, possibly gzip-compressed, are taken).
+    """
+    fli = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for fn in matches:
+            if os.path.isdir(fn):
+                fli.extend(sorted(os.path.join(fn, fn2) for fn2 in os.listdir(fn)
+                                  if (file_io.split_input_ext(fn2)[1] in exts
+                                      or file_io.is_archive(fn2))
+                                  and os.path.isfile(os.path.join(fn, fn2))))
+            else:
+                fli.append(fn)
+    return fli
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="%s-cli" % version.title,
+        description="Analyse %s input files without the graphical user interface."
+                    % version.title,
+        epilog="Exit codes: 0 = processed cleanly; 1 = unexpected error or "
+               "unreadable results file; 2 = invalid command line or no input "
+               "files; 3 = errors in one or more input files; 4 = warnings; "
+               "130 = interrupted.")
+    parser.add_argument('inputs', nargs='*', metavar='INPUT',
+                        help="input file (possibly gzip-compressed), archive (.zip, "
+                             ".tar or .tar.gz), glob pattern or directory")
+    parser.add_argument('-c', '--options', metavar='FILE',
+                        help="configuration file to read options from (same "
+                             "format as the one saved by the GUI)")
+    parser.add_argument('-o', '--output-dir', metavar='DIR', default='out',
+                        help="directory for output files (default: %(default)s)")
+    parser.add_argument('-f', '--format', choices=('excel', 'csv', 'npz', 'feather', 'sqlite'),
+                        help="output file format; npz and feather store each "
+                             "summary as typed columns (feather requires pyarrow), "
+                             "and sqlite stores all summaries in a database")
+    parser.add_argument('--database', metavar='FILE',
+                        help="SQLite database to add the results of the session to "
+                             "(implies -f sqlite; default: summaries.sqlite in the "
+                             "output directory)")
+    parser.add_argument('--single-file', action='store_true', default=None,
+                        help="write all summaries to a single file (a workbook with "
+                             "one sheet per summary, or a zip archive of csv files)")
+    parser.add_argument('-j', '--jobs', type=int, metavar='N',
+                        help="number of parallel worker processes (0 = all CPUs)")
+    parser.add_argument('--prefetch', type=int, metavar='N',
+                        help="number of input files to read ahead while processing "
+                             "(0 = none; only when not running in parallel)")
+    parser.add_argument('--cache-dir', metavar='DIR',
+                        help="cache processed profiles in DIR, and reuse them for "
+                             "unchanged input files")
+    parser.add_argument('--cache-max-size', type=int, metavar='MB',
+                        help="maximum size of the result cache in megabytes")
+    parser.add_argument('--save-preparsed', action='store_true', default=None,
+                        help="save each parsed and validated text input file as a "
+                             "pre-parsed profile file (%s), which loads faster"
+                             % core.OptionData().preparsed_filename_ext)
+    parser.add_argument('--save-results', metavar='FILE',
+                        help="save the processed profiles of the session to FILE, "
+                             "from which the summaries can be saved again with "
+                             "other output options using --reexport")
+    parser.add_argument('--reexport', metavar='FILE',
+                        help="save the summaries of the session in the results "
+                             "file FILE with the given output options, without "
+                             "processing the input files again (no input files "
+                             "are then given)")
+    parser.add_argument('--timing', action='store_true', default=None,
+                        help="save a timing summary with the wall and CPU time "
+                             "spent in each stage of processing each profile")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="save a trace of the session (the processing of "
+                             "each profile and its stages, in each worker "
+                             "process) to FILE in the Chrome trace-event JSON "
+                             "format")
+    parser.add_argument('--version', action='version',
+                        version="%s %s" % (version.title, version.version))
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    opt = core.OptionData()
+    if args.options is not None:
+        if not os.path.isfile(args.options):
+            sys.stderr.write("Error: options file '%s' not found.\n" % args.options)
+            return EXIT_USAGE
+        opt.read_config(args.options,
+                        warn=lambda s: sys.stderr.write("Warning: %s\n" % s))
+    # Only the GUI keeps the results of the last session; use --save-results
+    opt.keep_session_results = False
+    if args.format is not None:
+        opt.output_file_format = args.format
+    if args.database is not None:
+        opt.output_file_format = 'sqlite'
+        opt.output_database = args.database
+    if opt.output_file_format == 'excel':
+        opt.output_filename_ext = '.xlsx'
+    elif opt.output_file_format == 'csv':
+        opt.output_filename_ext = '.csv'
+    if args.single_file is not None:
+        opt.single_output_file = args.single_file
+    if args.jobs is not None:
+        if args.jobs < 0:
+            sys.stderr.write("Error: number of jobs must not be negative.\n")
+            return EXIT_USAGE
+        opt.processes = args.jobs
+    if args.prefetch is not None:
+        if args.prefetch < 0:
+            sys.stderr.write("Error: number of files to read ahead must not be negative.\n")
+            return EXIT_USAGE
+        opt.prefetch_depth = args.prefetch
+    if args.cache_dir is not None:
+        opt.cache_dir = args.cache_dir
+    if args.cache_max_size is not None:
+        opt.cache_max_size = args.cache_max_size
+    if args.save_preparsed is not None:
+        opt.save_preparsed_profiles = args.save_preparsed
+    if args.save_results is not None:
+        opt.results_file = args.save_results
+    if args.timing is not None:
+        opt.timing_summary = args.timing
+    if args.trace is not None:
+        opt.trace_file = args.trace
+    results = None
+    if args.reexport is not None:
+        if args.inputs:
+            sys.stderr.write("Error: input files cannot be given with --reexport.\n")
+            return EXIT_USAGE
+        from . import results as results_module
+        try:
+            results = results_module.SessionResults.load(args.reexport)
+        except (IOError, ValueError) as err:
+            sys.stderr.write("Error: could not read results file '%s': %s.\n"
+                             % (args.reexport, err))
+            return EXIT_USAGE
+    else:
+        opt.input_file_list = expand_input_files(args.inputs, (opt.input_filename_ext,
+                                                               opt.preparsed_filename_ext))
+        if not opt.input_file_list:
+            sys.stderr.write("Error: no input files found.\n")
+            return EXIT_USAGE
+    opt.output_dir = args.output_dir
+    try:
+        if not os.path.isdir(opt.output_dir):
+            os.makedirs(opt.output_dir)
+    except OSError:
+        sys.stderr.write("Error: could not create output directory '%s'.\n" % opt.output_dir)
+        return EXIT_USAGE
+    try:
+        if results is not None:
+            ret = main_module.reexport_proc(BatchSession(opt), results)
+        else:
+            ret = main_module.main_proc(BatchSession(opt))
+    except KeyboardInterrupt:
+        opt.stop_requested = True
+        sys.stderr.write("\nInterrupted.\n")
+        return EXIT_INTERRUPTED
+    return _exit_codes[ret]
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,289 @@
+#
+#    A simple csv module look-a-like writer of columnar data files:
+#
+#    Collects the rows written to it as typed columns, and writes them to
+#    an .npz file (a zip archive with a NumPy .npy array for each column,
+#    as written by numpy.savez()) or to a Feather file. The .npz files are
+#    written without NumPy, whereas Feather files require pyarrow.
+#
+#    The first row written holds the column names. Integer, float and
+#    yes/no columns are stored as such; empty and N/A values in numeric
+#    columns are stored as NaN (or as nulls in Feather files). Other
+#    columns are stored as strings. In .npz files, '/' and '\\' in column
+#    names are replaced by '_' (see npz_key()).
+#
+#    The rows are not held in memory: they are spooled in batches to a
+#    temporary file, while the types of the columns are determined. When
+#    the writer is closed, the spooled rows are read back and written out
+#    column by column (.npz), or as a record batch per spooled batch
+#    (Feather). Thus, memory use is bounded by the size of a batch (and,
+#    for .npz files, the number of columns written from each pass over
+#    the spooled rows), rather than by the size of the summary.
+#
+#    N.B. The writer object needs to be explicitly closed.
+
+import array
+import pickle
+import shutil
+import struct
+import sys
+import tempfile
+import zipfile
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+MISSING_VALUES = ("", "N/A")
+
+# Number of rows spooled at a time
+SPOOL_BATCH_ROWS = 4096
+
+# Number of .npz columns written from each pass over the spooled rows
+COLUMN_GROUP_SIZE = 64
+
+
+def _kind(value):
+    t = type(value)
+    if t is float:
+        return 'float'
+    if t is int:
+        return 'int'
+    if value is None or value in MISSING_VALUES:
+        return 'missing'
+    if value in ("yes", "no"):
+        return 'bool'
+    return 'str'
+
+
+def _column_type(kinds):
+    """ Return the type of a column with values of kinds (see _kind()) """
+    missing = 'missing' in kinds
+    kinds = kinds - {'missing'}
+    if not kinds or kinds == {'float'}:
+        return 'float'
+    if kinds == {'int'}:
+        return 'float' if missing else 'int'
+    if kinds == {'int', 'float'}:
+        return 'float'
+    if kinds == {'bool'} and not missing:
+        return 'bool'
+    return 'str'
+
+
+def column_type(values):
+    """ Return the type in which values are stored:
+        'int', 'float', 'bool' or 'str'
+    """
+    return _column_type(set(map(_kind, values)))
+
+
+def unique_names(names):
+    """ Return names with duplicates made unique by a numbered suffix """
+    seen = set()
+    uniq = []
+    for name in names:
+        new_name, n = name, 1
+        while new_name in seen:
+            n += 1
+            new_name = "%s (%d)" % (name, n)
+        seen.add(new_name)
+        uniq.append(new_name)
+    return uniq
+
+
+def npz_key(name):
+    """ Return column name as the name of an array in an .npz file, with
+        path separators (which would put the array in a directory of the
+        zip archive) replaced by underscores
+    """
+    return name.replace('/', '_').replace('\\', '_')
+
+
+def _column(batch, n):
+    """ Return the values in column n of the rows in batch """
+    return [row[n] if n < len(row) else None for row in batch]
+
+
+def _strings(values):
+    return ["" if v is None else str(v) for v in values]
+
+
+def npy_data(values, coltype):
+    """ Return values of type coltype (other than 'str') as the data of
+        an .npy array
+    """
+    if coltype == 'int':
+        data = array.array('q', values)
+    elif coltype == 'float':
+        nan = float('nan')
+        data = array.array('d', [nan if _kind(v) == 'missing' else v
+                                 for v in values])
+    else:
+        return bytes(v == "yes" for v in values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data.tobytes()
+
+
+def npy_str_data(strli, width):
+    """ Return the strings in strli as the data of an .npy array of
+        strings of length width
+    """
+    return "".join([s.ljust(width, '\0') for s in strli]).encode('utf-32-le')
+
+
+def npy_header(descr, n):
+    """ Return the .npy header of an array of n elements of type descr """
+    header = ("{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }"
+              % (descr, n))
+    # Pad the header so that the data is aligned to 64 bytes, as NumPy does
+    header += " " * (-(len(NPY_MAGIC) + 2 + len(header) + 1) % 64) + "\n"
+    return NPY_MAGIC + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+NPY_DESCR = {'int': '<i8', 'float': '<f8', 'bool': '|b1'}
+
+
+def npy_bytes(values, coltype):
+    """ Return values of type coltype in the NumPy .npy format """
+    if coltype == 'str':
+        strli = _strings(values)
+        width = max([len(s) for s in strli] + [1])
+        return npy_header('<U%d' % width, len(values)) + npy_str_data(strli, width)
+    return npy_header(NPY_DESCR[coltype], len(values)) + npy_data(values, coltype)
+
+
+class Writer(object):
+    """ Writes rows as columns to f (a filename or a binary file object)
+        in the format fmt ('npz' or 'feather') when closed
+    """
+    def __init__(self, f, fmt='npz'):
+        self.f = f
+        self.fmt = fmt
+        self.names = None
+        self.kinds = []
+        self.nrows = 0
+        self.batch = []
+        self.spool = None
+
+    def writerow(self, row):
+        if self.names is None:
+            self.names = [str(element) for element in row]
+            return
+        self.batch.append(tuple(row))
+        if len(self.batch) >= SPOOL_BATCH_ROWS:
+            self.__spool_batch()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def __spool_batch(self):
+        """ Write the batch of rows to the spool file, and add the kinds of
+            their values to those of the columns
+        """
+        batch = self.batch
+        width = max(len(row) for row in batch)
+        # Columns that were not in the previous rows are missing there
+        self.kinds.extend({'missing'} if self.nrows else set()
+                          for n in range(len(self.kinds), width))
+        for n, kinds in enumerate(self.kinds):
+            kinds.update(map(_kind, _column(batch, n)))
+        if self.spool is None:
+            self.spool = tempfile.TemporaryFile()
+        pickle.dump(batch, self.spool, pickle.HIGHEST_PROTOCOL)
+        self.nrows += len(batch)
+        self.batch = []
+
+    def __batches(self):
+        """ Yield the spooled batches of rows """
+        if self.spool is None:
+            return
+        self.spool.seek(0)
+        while True:
+            try:
+                yield pickle.load(self.spool)
+            except EOFError:
+                return
+
+    def close(self):
+        if self.batch:
+            self.__spool_batch()
+        names = list(self.names or [])
+        self.kinds.extend({'missing'} if self.nrows else set()
+                          for n in range(len(self.kinds), len(names)))
+        names.extend("Column %d" % (n + 1)
+                     for n in range(len(names), len(self.kinds)))
+        names = unique_names(names)
+        coltypes = [_column_type(kinds) for kinds in self.kinds]
+        try:
+            if self.fmt == 'feather':
+                self.__write_feather(names, coltypes)
+            else:
+                self.__write_npz(names, coltypes)
+        finally:
+            if self.spool is not None:
+                self.spool.close()
+                self.spool = None
+
+    def __write_npz(self, names, coltypes):
+        names = unique_names([npz_key(name) for name in names])
+        with zipfile.ZipFile(self.f, 'w', zipfile.ZIP_STORED) as zf:
+            for first in range(0, len(names), COLUMN_GROUP_SIZE):
+                group = range(first, min(first + COLUMN_GROUP_SIZE, len(names)))
+                # The data of each column in the group (or for string
+                # columns, the strings, whose width is not yet known)
+                tmpfiles = dict((n, tempfile.TemporaryFile()) for n in group)
+                widths = dict((n, 1) for n in group)
+                try:
+                    for batch in self.__batches():
+                        for n in group:
+                            values = _column(batch, n)
+                            if coltypes[n] == 'str':
+                                strli = _strings(values)
+                                widths[n] = max([len(s) for s in strli] + [widths[n]])
+                                pickle.dump(strli, tmpfiles[n], pickle.HIGHEST_PROTOCOL)
+                            else:
+                                tmpfiles[n].write(npy_data(values, coltypes[n]))
+                    for n in group:
+                        with zf.open(names[n] + '.npy', 'w', force_zip64=True) as member:
+                            self.__write_npy(member, tmpfiles[n], coltypes[n], widths[n])
+                finally:
+                    for tmpf in tmpfiles.values():
+                        tmpf.close()
+
+    def __write_npy(self, member, tmpf, coltype, width):
+        tmpf.seek(0)
+        if coltype != 'str':
+            member.write(npy_header(NPY_DESCR[coltype], self.nrows))
+            shutil.copyfileobj(tmpf, member)
+            return
+        member.write(npy_header('<U%d' % width, self.nrows))
+        while True:
+            try:
+                member.write(npy_str_data(pickle.load(tmpf), width))
+            except EOFError:
+                return
+
+    def __write_feather(self, names, coltypes):
+        import pyarrow
+        from pyarrow import ipc
+        types = {'int': pyarrow.int64(), 'float': pyarrow.float64(),
+                 'bool': pyarrow.bool_(), 'str': pyarrow.string()}
+        schema = pyarrow.schema([(name, types[coltype])
+                                 for name, coltype in zip(names, coltypes)])
+        if pyarrow.Codec.is_available('lz4'):
+            options = ipc.IpcWriteOptions(compression='lz4')
+        else:
+            options = ipc.IpcWriteOptions()
+        with ipc.new_file(self.f, schema, options=options) as writer:
+            for batch in self.__batches():
+                arrays = []
+                for n, coltype in enumerate(coltypes):
+                    values = _column(batch, n)
+                    if coltype == 'float':
+                        values = [None if _kind(v) == 'missing' else v for v in values]
+                    elif coltype == 'bool':
+                        values = [v == "yes" for v in values]
+                    elif coltype == 'str':
+                        values = [None if v is None else str(v) for v in values]
+                    arrays.append(pyarrow.array(values, types[coltype]))
+                writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=schema))
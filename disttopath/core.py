@@ -1,7 +1,14 @@
+import collections
+import copy
+import os.path
 import random
+import re
 import sys
+import types
 from . import geometry
 from . import file_io
+from . import stringconv
+from . import timing
 
 
 # Convenience functions
@@ -47,18 +54,20 @@ class Point(geometry.Point):
         else:
             geometry.Point.__init__(self, x, y)
         self.profile = profile
-        if self.profile is not None:
-            self.opt = self.profile.opt
-        else:
-            self.opt = None
         self.discard = False
         self.ptype = ptype
         self.cluster = None
         self.nearest_neighbour_dist = None
-        self.nearest_neighbour_point = geometry.Point()
+        self.nearest_neighbour_point = None
         self.nearest_lateral_neighbour_dist = None
-        self.nearest_lateral_neighbour_point = geometry.Point()
-        self.nearest_neighbour = geometry.Point()
+        self.nearest_lateral_neighbour_point = None
+        self.nearest_neighbour = None
+
+    @property
+    def opt(self):
+        if self.profile is not None:
+            return self.profile.opt
+        return None
 
     def determine_stuff(self):
         """Determine general stuff for a point, including distance to path.
@@ -94,39 +103,31 @@ class Point(geometry.Point):
     @lazy_property
     def lateral_dist_path(self):
         """Return lateral distance along path"""
-        return self.lateral_dist(self.profile.path)
+        geom = self.profile.geom
+        return self.lateral_dist(geom.path, center=(geom.center, geom.center_seg))
 
     @lazy_property
     def norm_lateral_dist_path(self):
         """Return normalized lateral distance along path"""
-        return self.lateral_dist_path / (self.profile.path.length() / 2)
+        return self.lateral_dist_path / self.profile.geom.half_length
 
     @lazy_property
     def is_within_hole(self):
         """Determine whether self is inside a profile hole"""
-        is_within_hole = False
-        for h in self.profile.holeli:
-            if self.is_within_polygon(h):
-                is_within_hole = True
-            else:
-                is_within_hole = False
-        return is_within_hole
+        return self.profile.geom.is_within_hole(self)
 
     @lazy_property
     def is_within_shell(self):
         """Determine whether self is within shell"""
         return (self.dist_to_path is not None
-                and abs(self.dist_to_path) <= geometry.to_pixel_units(self.opt.shell_width,
-                                                                      self.profile.pixelwidth))
+                and abs(self.dist_to_path) <= self.profile.geom.shell_width)
 
     @lazy_property
     def is_associated_with_path(self):
         """Determine whether self is associated with the profile
         border, i e, is within a distance of it that is less than
         the spatial resolution"""
-        if (abs(self.dist_to_path) <= geometry.to_pixel_units(
-                self.profile.opt.spatial_resolution,
-                self.profile.pixelwidth)):
+        if abs(self.dist_to_path) <= self.profile.geom.spatial_resolution:
             return True
         else:
             return False
@@ -155,7 +156,8 @@ class Point(geometry.Point):
         minp = Point()
         for p in pointli:
             if p is not self:
-                d = self.lateral_dist_to_point(p, self.profile.path)
+                d = self.lateral_dist_to_point(p, self.profile.path,
+                                               perimeter=self.profile.geom.perimeter)
                 if d < mindist:
                     mindist = d
                     minp = p
@@ -167,6 +169,30 @@ class Point(geometry.Point):
             return self.nearest_lateral_neighbour_dist
 
 
+# A simulated (Monte Carlo) point is only kept as its coordinates and
+# its distance to the path; see Profile.simulated_points() for
+# obtaining full Point objects
+SimulatedPoint = collections.namedtuple('SimulatedPoint', 'x y dist_to_path')
+
+
+# Monte Carlo runs keep only these descriptors of their clusters
+ClusterSummary = collections.namedtuple('ClusterSummary',
+                                        'n_points dist_to_path dist_to_nearest_cluster')
+
+
+# The values of a profile and of its particles and random points that are
+# written to the profile and point summaries, computed once when the
+# profile is processed (lengths in metric units); see Profile.summarize()
+ProfileSummary = collections.namedtuple('ProfileSummary',
+                                        'path_length n_particles n_positive '
+                                        'n_positive_shell n_negative_shell '
+                                        'n_positive_shell_or_associated n_associated')
+
+PointSummary = collections.namedtuple('PointSummary',
+                                      'dist_to_path lateral_dist_path '
+                                      'norm_lateral_dist_path is_associated_with_path')
+
+
 class PointList(list):
     def __init__(self, pointli, ptype, profile):
         super().__init__()
@@ -187,13 +213,50 @@ class Cluster(list):
             raise TypeError("not a point list")
         self.convex_hull = geometry.SegmentedPath()
 
-    def lateral_dist_to_cluster(self, c2, path):
+    def lateral_dist_to_cluster(self, c2, path, perimeter=None):
         """Determine lateral distance to a cluster c2 along profile
         border.
         """
         centroid = Point(self.convex_hull.centroid())
         centroid2 = Point(c2.convex_hull.centroid())
-        return centroid.lateral_dist_to_point(centroid2, path)
+        return centroid.lateral_dist_to_point(centroid2, path, perimeter=perimeter)
+
+
+class ProfileGeometry:
+    """Geometry of a profile that is needed to evaluate a point and
+    that does not depend on the point itself. It is computed once per
+    profile (after the paths have been validated) and then shared by
+    all particles, random points and simulated points of that profile.
+    """
+    def __init__(self, profile):
+        opt = profile.opt
+        self.path = profile.path
+        self.posloc = profile.posloc
+        self.holeli = profile.holeli
+        self.length = self.path.length()
+        self.half_length = self.length / 2
+        self.perimeter = self.path.perimeter()
+        self.center = self.path.center_point()
+        __, self.center_seg = self.center.project_on_path_or_endnode(self.path)
+        self.box = self.path.bounding_box()
+        self.shell_width = geometry.to_pixel_units(opt.shell_width, profile.pixelwidth)
+        self.spatial_resolution = geometry.to_pixel_units(opt.spatial_resolution,
+                                                          profile.pixelwidth)
+        self.within_cluster_dist = geometry.to_pixel_units(opt.within_cluster_dist,
+                                                           profile.pixelwidth)
+        # Bounding box (lox, loy, hix, hiy) of each hole, so that the
+        # full polygon test is only done for points that may be inside
+        self.hole_index = []
+        for h in self.holeli:
+            b = h.bounding_box()
+            self.hole_index.append(((b[0].x, b[0].y, b[2].x, b[2].y), h))
+
+    def is_within_hole(self, p):
+        """Determine whether p is inside any of the profile holes"""
+        for (lox, loy, hix, hiy), h in self.hole_index:
+            if lox <= p.x <= hix and loy <= p.y <= hiy and p.is_within_polygon(h):
+                return True
+        return False
 
 
 class Profile:
@@ -215,9 +278,69 @@ class Profile:
         self.metric_unit = ''
         self.posloc = geometry.Point()
         self.path = geometry.SegmentedPath()
+        self.geom = None
+        self.summary = None
+        self.point_summaries = {'particle': [], 'random': []}
+        self.preparsed = False
+        self.timings = {}
+        self.trace_events = [] if opt.trace_file else None
+        self.warnli = []
         self.warnflag = False
         self.errflag = False             
 
+    def __getstate__(self):
+        """ Leave out the options when pickled (for instance, when
+            returned from a worker process or cached); they are set
+            again by the receiver.
+        """
+        state = self.__dict__.copy()
+        state['opt'] = None
+        return state
+
+    def release_data(self):
+        """ Release the point data of the profile (points, distances,
+            clusters and Monte Carlo simulations), e.g. when its results
+            have been saved. What describes the profile as a whole, such
+            as its path, id and error and warning flags, is kept.
+        """
+        self.pli, self.randomli, self.mcli, self.clusterli = [], [], [], []
+        self.pp_distli, self.pp_latdistli = [], []
+        self.rp_distli, self.rp_latdistli = [], []
+        self.point_summaries = {'particle': [], 'random': []}
+        self.geom = None
+
+    def summarize(self):
+        """ Compute the summary records of the profile and of its
+            particles and random points, in a single pass over each
+            point list
+        """
+        pw = self.pixelwidth
+        n_positive = n_positive_shell = n_negative_shell = 0
+        n_positive_shell_or_associated = n_associated = 0
+        for p in self.pli:
+            positive_shell = False
+            if p.dist_to_path >= 0:
+                n_positive += 1
+                if p.is_within_shell:
+                    n_positive_shell += 1
+                    positive_shell = True
+            elif p.is_within_shell:
+                n_negative_shell += 1
+            if p.is_associated_with_path:
+                n_associated += 1
+            if positive_shell or p.is_associated_with_path:
+                n_positive_shell_or_associated += 1
+        self.summary = ProfileSummary(geometry.to_metric_units(self.geom.length, pw),
+                                      len(self.pli), n_positive, n_positive_shell,
+                                      n_negative_shell, n_positive_shell_or_associated,
+                                      n_associated)
+        for ptype, pli in (('particle', self.pli), ('random', self.randomli)):
+            self.point_summaries[ptype] = [
+                PointSummary(geometry.to_metric_units(p.dist_to_path, pw),
+                             geometry.to_metric_units(p.lateral_dist_path, pw),
+                             p.norm_lateral_dist_path,
+                             p.is_associated_with_path) for p in pli]
+
     def process(self, opt):
         """ Parse profile data from a file and determine distances
         """
@@ -227,13 +350,24 @@ class Profile:
                 pt.determine_stuff()
 
         try:
-            self.__parse()
-            self.__check_paths()
-            sys.stdout.write("Determining distances etc...\n")
-            compute_stuff(self.pli)
-            self.pli = [p for p in self.pli if not p.discard]
-            compute_stuff(self.randomli)
-            self.randomli = [p for p in self.randomli if not p.discard]
+            with timing.stage(self.timings, 'parse', self.trace_events):
+                self.__parse()
+            if self.preparsed:
+                sys.stdout.write("  Paths are ok (checked when pre-parsed).\n")
+            else:
+                with timing.stage(self.timings, 'check paths', self.trace_events):
+                    self.__check_paths()
+                if self.opt.save_preparsed_profiles:
+                    with timing.stage(self.timings, 'save pre-parsed', self.trace_events):
+                        self.__save_preparsed()
+            with timing.stage(self.timings, 'point distances', self.trace_events):
+                self.geom = ProfileGeometry(self)
+                sys.stdout.write("Determining distances etc...\n")
+                compute_stuff(self.pli)
+                self.pli = [p for p in self.pli if not p.discard]
+                compute_stuff(self.randomli)
+                self.randomli = [p for p in self.randomli if not p.discard]
+                self.summarize()
             for ptype in ('particle', 'random'):
                 if ptype == 'random' and not opt.use_random:
                     continue
@@ -242,13 +376,16 @@ class Profile:
                                  % (ptypestr, self.n_discarded[ptype]))
             if self.opt.determine_interpoint_dists:
                 sys.stdout.write("Determining interpoint distances...\n")
-                self.__determine_interdistlis()
+                with timing.stage(self.timings, 'interpoint distances', self.trace_events):
+                    self.__determine_interdistlis()
             if self.opt.determine_clusters:
                 sys.stdout.write("Determining clusters...\n")
-                self.clusterli = self.__determine_clusters(self.pli)
+                with timing.stage(self.timings, 'clusters', self.trace_events):
+                    self.clusterli = self.__determine_clusters(self.pli)
             if self.opt.run_monte_carlo:
                 sys.stdout.write("Running Monte Carlo simulations...\n")
-                self.__run_monte_carlo()
+                with timing.stage(self.timings, 'Monte Carlo', self.trace_events):
+                    self.__run_monte_carlo()
             if opt.stop_requested:
                 return
             sys.stdout.write("Done.\n")
@@ -277,7 +414,8 @@ class Profile:
                     if self.opt.interpoint_shortest_dist:
                         dli.append(pointli[i].dist(pointli[j]))
                     if self.opt.interpoint_lateral_dist:
-                        latdli.append(pointli[i].lateral_dist_to_point(pointli[j], self.path))
+                        latdli.append(pointli[i].lateral_dist_to_point(
+                            pointli[j], self.path, perimeter=self.geom.perimeter))
             elif self.opt.interpoint_dist_mode == 'nearest neighbour':
                 if self.opt.interpoint_shortest_dist:
                     dli.append(pointli[i].get_nearest_neighbour(pointli))
@@ -300,7 +438,8 @@ class Profile:
                     if self.opt.interpoint_shortest_dist:
                         dli.append(p.dist(p2))
                     if self.opt.interpoint_lateral_dist:
-                        latdli.append(p.lateral_dist_to_point(p2, self.path))
+                        latdli.append(p.lateral_dist_to_point(p2, self.path,
+                                                              perimeter=self.geom.perimeter))
             elif self.opt.interpoint_dist_mode == 'nearest neighbour':
                 if self.opt.interpoint_shortest_dist:
                     dli.append(p.get_nearest_neighbour(pointli2))
@@ -312,9 +451,8 @@ class Profile:
 
     def __run_monte_carlo(self):
 
-        def in_window(p_candidate):
-            d = p_candidate.dist_to_path
-            if d is None or abs(d) >= border or p_candidate.is_within_hole:
+        def in_window(p_candidate, d):
+            if d is None or abs(d) >= geom.shell_width or geom.is_within_hole(p_candidate):
                 return False
             if self.opt.monte_carlo_simulation_window == "shell":
                 return True
@@ -324,52 +462,94 @@ class Profile:
                 return True
             return False
 
-        border = geometry.to_pixel_units(self.opt.shell_width, self.pixelwidth)
-        numpoints = len([p for p in self.pli if in_window(p)])
-        box = self.path.bounding_box()
+        geom = self.geom
+        numpoints = len([p for p in self.pli if in_window(p, p.dist_to_path)])
         mcli = []
         dot_progress(reset=True)
         for n in range(0, self.opt.monte_carlo_runs):
             if self.opt.stop_requested:
                 return []
             dot_progress()
-            mcli.append({'pli': [],
-                         'simulated - simulated': {'dist': [], 'latdist': []},
-                         'simulated - particle': {'dist': [], 'latdist': []},
-                         'particle - simulated': {'dist': [], 'latdist': []},
-                         'clusterli': []})
-            for __ in range(0, numpoints):
-                while True:
-                    x = random.randint(int(box[0].x - border), int(box[1].x + border) + 1)
-                    y = random.randint(int(box[0].y - border), int(box[2].y + border) + 1)
-                    p = Point(x, y, profile=self)
-                    if p not in mcli[n]['pli'] and in_window(p):
-                        break
-                # escape the while loop when a valid simulated point
-                # is found
-                mcli[n]['pli'].append(p)
-            for p in mcli[n]['pli']:
-                p.determine_stuff()
-            if self.opt.interpoint_relations['simulated - simulated']:
-                distlis = self.__get_same_interpoint_distances(mcli[n]['pli'])
-                mcli[n]['simulated - simulated']['dist'].append(distlis[0])
-                mcli[n]['simulated - simulated']['latdist'].append(distlis[1])
-            if self.opt.interpoint_relations['simulated - particle']:
-                distlis = self.__get_interpoint_distances2(mcli[n]['pli'], self.pli)
-                mcli[n]['simulated - particle']['dist'].append(distlis[0])
-                mcli[n]['simulated - particle']['latdist'].append(distlis[1])
-            if self.opt.interpoint_relations['particle - simulated']:
-                distlis = self.__get_interpoint_distances2(self.pli, mcli[n]['pli'])
-                mcli[n]['particle - simulated']['dist'].append(distlis[0])
-                mcli[n]['particle - simulated']['latdist'].append(distlis[1])
-        if self.opt.determine_clusters:
-            dot_progress(reset=True)
-            for n, li in enumerate(mcli):
-                dot_progress()
-                mcli[n]['clusterli'] = self.__determine_clusters(li['pli'])
+            with timing.span(self.trace_events, "Monte Carlo run %d" % (n + 1),
+                             'Monte Carlo run'):
+                mcli.append(self.__simulate_run(numpoints, in_window))
         self.mcli = mcli
         sys.stdout.write("\n")
 
+    def __simulate_run(self, numpoints, in_window):
+        """ Perform a single Monte Carlo run: generate numpoints random
+            points that are accepted by in_window, and determine
+            interpoint distances and (optionally) clusters for them.
+            Only the SimulatedPoint records, the distances and compact
+            cluster descriptors are kept.
+        """
+        geom = self.geom
+        border = geom.shell_width
+        box = geom.box
+        run = {'pli': [],
+               'simulated - simulated': {'dist': [], 'latdist': []},
+               'simulated - particle': {'dist': [], 'latdist': []},
+               'particle - simulated': {'dist': [], 'latdist': []},
+               'clusterli': []}
+        taken = set()
+        for __ in range(0, numpoints):
+            while True:
+                x = random.randint(int(box[0].x - border), int(box[1].x + border) + 1)
+                y = random.randint(int(box[0].y - border), int(box[2].y + border) + 1)
+                if (x, y) in taken:
+                    continue
+                p = geometry.Point(x, y)
+                d = p.perpend_dist(geom.path, posloc=geom.posloc)
+                if in_window(p, d):
+                    break
+            # escape the while loop when a valid simulated point
+            # is found
+            taken.add((x, y))
+            run['pli'].append(SimulatedPoint(p.x, p.y, d))
+        use_points = self.opt.determine_clusters or True in [
+            val for key, val in self.opt.interpoint_relations.items() if 'simulated' in key]
+        if not use_points:
+            return run
+        simpli = self.__make_simulated_points(run['pli'])
+        if self.opt.interpoint_relations['simulated - simulated']:
+            distlis = self.__get_same_interpoint_distances(simpli)
+            run['simulated - simulated']['dist'].append(distlis[0])
+            run['simulated - simulated']['latdist'].append(distlis[1])
+        if self.opt.interpoint_relations['simulated - particle']:
+            distlis = self.__get_interpoint_distances2(simpli, self.pli)
+            run['simulated - particle']['dist'].append(distlis[0])
+            run['simulated - particle']['latdist'].append(distlis[1])
+        if self.opt.interpoint_relations['particle - simulated']:
+            distlis = self.__get_interpoint_distances2(self.pli, simpli)
+            run['particle - simulated']['dist'].append(distlis[0])
+            run['particle - simulated']['latdist'].append(distlis[1])
+        if self.opt.determine_clusters:
+            clusterli = self.__determine_clusters(simpli)
+            # Clusters may be incompletely processed if stopped
+            if self.opt.stop_requested:
+                return run
+            run['clusterli'] = [ClusterSummary(len(c), c.dist_to_path, c.dist_to_nearest_cluster)
+                                for c in clusterli]
+        return run
+
+    def __make_simulated_points(self, simli):
+        """ Return full Point objects for the SimulatedPoint records in
+            simli.
+        """
+        pli = []
+        for sp in simli:
+            p = Point(sp.x, sp.y, profile=self)
+            # Already known, so spare the lazy property the computation
+            p._lazy_dist_to_path = sp.dist_to_path
+            pli.append(p)
+        return pli
+
+    def simulated_points(self, n):
+        """ Return the simulated points of Monte Carlo run n as Point
+            objects.
+        """
+        return self.__make_simulated_points(self.mcli[n]['pli'])
+
     def __process_clusters(self, clusterli):
         for c in clusterli:
             if self.opt.stop_requested:
@@ -386,7 +566,7 @@ class Profile:
             c.dist_to_nearest_cluster = sys.maxsize
             for c2 in clusterli:
                 if c2 != c:
-                    d = c.lateral_dist_to_cluster(c2, self.path)
+                    d = c.lateral_dist_to_cluster(c2, self.path, perimeter=self.geom.perimeter)
                     if d < c.dist_to_nearest_cluster:
                         c.dist_to_nearest_cluster = d
                         c.nearest_cluster = c2
@@ -405,9 +585,7 @@ class Profile:
             if p1.cluster:
                 continue
             for p2 in pointli:
-                if p1 != p2 and p1.dist(p2) <= geometry.to_pixel_units(
-                        self.opt.within_cluster_dist,
-                        self.pixelwidth):
+                if p1 != p2 and p1.dist(p2) <= self.geom.within_cluster_dist:
                     if p2.cluster is not None:
                         p1.cluster = p2.cluster
                         clusterli[p1.cluster].append(p1)
@@ -419,55 +597,141 @@ class Profile:
         return clusterli
 
     def __parse(self):
-        """ Parse profile data from input file 
+        """ Parse profile data from input file; the file is read one line
+            at a time
         """
+        if is_preparsed(self.inputfn):
+            self.__load_preparsed()
+            return
         sys.stdout.write("\nParsing '%s':\n" % self.inputfn)
-        li = file_io.read_file(self.inputfn)
-        if not li:
+        try:
+            f = file_io.open_input(self.inputfn)
+        except IOError:
+            sys.stdout.write("Error: File not found or unreadable\n")
             raise ProfileError(self, "Could not open input file")
-        while li:
-            s = li.pop(0).replace('\n', '').strip()
-            if s.split(' ')[0].upper() == 'IMAGE':
-                self.src_img = s.split(' ')[1]
-            elif s.split(' ')[0].upper() == 'PROFILE_ID':
+        with f:
+            if not self.__parse_lines(file_io.LineReader(f)):
+                raise ProfileError(self, "Could not open input file")
+        # Now, let's see if everything was found
+        self.__check_parsed_data()
+
+    def __load_preparsed(self):
+        """ Load profile data from a pre-parsed profile file (see
+            __save_preparsed()). The warnings issued when the profile was
+            originally parsed are issued again.
+        """
+        def to_points(a):
+            it = iter(a)
+            return [geometry.Point(x, y) for x, y in zip(it, it)]
+
+        sys.stdout.write("\nLoading pre-parsed profile '%s':\n" % self.inputfn)
+        try:
+            meta, arrays = file_io.read_preparsed(self.inputfn)
+        except IOError:
+            sys.stdout.write("Error: File not found or unreadable\n")
+            raise ProfileError(self, "Could not open input file")
+        except ValueError as err:
+            raise ProfileError(self, "Invalid pre-parsed profile file (%s)" % err)
+        try:
+            self.src_img = meta['src_img']
+            self.id = meta['id']
+            self.comment = meta['comment']
+            self.pixelwidth = float(meta['pixelwidth'])
+            self.metric_unit = meta['metric_unit']
+            if meta['posloc'] is not None:
+                self.posloc = geometry.Point(*meta['posloc'])
+            self.path = geometry.SegmentedPath(to_points(arrays['path']))
+            self.holeli = [geometry.SegmentedPath(to_points(arrays['hole%d' % n]))
+                           for n in range(meta['holes'])]
+            self.pli = PointList(to_points(arrays['particles']), 'particle', self)
+            self.randomli = PointList(to_points(arrays['random']), 'random', self)
+            warnli = meta['warnings']
+        except (KeyError, TypeError, ValueError):
+            raise ProfileError(self, "Invalid pre-parsed profile file")
+        for msg in warnli:
+            profile_warning(self, msg)
+        self.preparsed = True
+        self.__check_parsed_data()
+
+    def __save_preparsed(self):
+        """ Save the parsed and validated profile data to a pre-parsed
+            profile file next to the input file, from which it can be
+            loaded without parsing and validating it again. Not done for
+            input files in archives.
+        """
+        def to_coords(pointli):
+            return [c for p in pointli for c in (p.x, p.y)]
+
+        if file_io.split_member(self.inputfn)[1] is not None:
+            sys.stdout.write("  Input file is in an archive; pre-parsed profile not saved.\n")
+            return
+        fn = file_io.split_input_ext(self.inputfn)[0] + self.opt.preparsed_filename_ext
+        meta = {'src_img': self.src_img,
+                'id': self.id,
+                'comment': self.comment,
+                'pixelwidth': self.pixelwidth,
+                'metric_unit': self.metric_unit,
+                'posloc': [self.posloc.x, self.posloc.y] if self.posloc else None,
+                'holes': len(self.holeli),
+                'warnings': self.warnli}
+        arrays = {'path': to_coords(self.path),
+                  'particles': to_coords(self.pli),
+                  'random': to_coords(self.randomli)}
+        for n, h in enumerate(self.holeli):
+            arrays['hole%d' % n] = to_coords(h)
+        try:
+            file_io.write_preparsed(fn, meta, arrays)
+            sys.stdout.write("  Saved pre-parsed profile '%s'.\n" % fn)
+        except IOError:
+            profile_warning(self, "Could not save pre-parsed profile '%s'" % fn)
+
+    def __parse_lines(self, lines):
+        """ Parse profile data from lines, a file_io.LineReader. Return
+            the number of lines read.
+        """
+        n = 0
+        for s in lines:
+            n += 1
+            s = s.strip()
+            keyword, __, rest = s.partition(' ')
+            keyword = keyword.upper()
+            if keyword == 'IMAGE':
+                self.src_img = rest.split(' ')[0]
+            elif keyword == 'PROFILE_ID':
                 try:
-                    self.id = int(s.split(' ')[1])
-                except (IndexError, ValueError):
+                    self.id = int(rest.split(' ')[0])
+                except ValueError:
                     profile_warning(self, "Profile id not defined or invalid")
-            elif s.split(' ')[0].upper() == 'COMMENT':
-                try:
-                    self.comment = s.split(' ', 1)[1]
-                except IndexError:
-                    self.comment = ''
-            elif s.split(' ')[0].upper() == 'PIXELWIDTH':
+            elif keyword == 'COMMENT':
+                self.comment = rest
+            elif keyword == 'PIXELWIDTH':
                 try: 
-                    self.pixelwidth = float(s.split(' ')[1])
-                    self.metric_unit = s.split(' ')[2]
+                    args = rest.split(' ')
+                    self.pixelwidth = float(args[0])
+                    self.metric_unit = args[1]
                 except (IndexError, ValueError):
                     raise ProfileError(self, "PIXELWIDTH is not a valid number")
-            elif s.split(' ')[0].upper() == 'POSLOC':
+            elif keyword == 'POSLOC':
                 try:
-                    x, y = s.split(' ', 1)[1].split(', ')
-                    self.posloc = geometry.Point(float(x), float(y))
-                except (IndexError, ValueError):
+                    self.posloc = parse_posloc(rest)
+                except ValueError:
                     raise ProfileError(self, "POSLOC not valid")
             elif s.upper() == 'PATH':
-                self.path = geometry.SegmentedPath(self.__get_coords(li, 'path'))
+                self.path = geometry.SegmentedPath(self.__get_coords(lines, 'path'))
             elif s.upper() == 'HOLE':
-                self.holeli.append(geometry.SegmentedPath(self.__get_coords(li, 'hole')))
+                self.holeli.append(geometry.SegmentedPath(self.__get_coords(lines, 'hole')))
             elif s.upper() in ('POINTS', 'PARTICLES'):
-                self.pli = PointList(self.__get_coords(li, 'particle'), 'particle', self)
+                self.pli = PointList(self.__get_coords(lines, 'particle'), 'particle', self)
             elif s.upper() == 'RANDOM_POINTS':
-                self.randomli = PointList(self.__get_coords(li, 'random'), 'random', self)
+                self.randomli = PointList(self.__get_coords(lines, 'random'), 'random', self)
             elif s.upper() == 'GRID':
-                # Retrieve coordinates to dummy variable as they will not be used
-                __ = PointList(self.__get_coords(li, 'grid'), 'grid', self)
+                # Skip the coordinates as they will not be used
+                self.__get_coords(lines, 'grid')
                 profile_warning(self, "Grid found; however, as grids are no longer supported " 
                                       "it will be discarded")
-            elif s[0] != '#':          # unless specifically commented out           
+            elif s and s[0] != '#':          # unless specifically commented out
                 profile_warning(self, "Unrecognized string '%s' in input file" % s)
-        # Now, let's see if everything was found
-        self.__check_parsed_data()
+        return n
 
     def __check_parsed_data(self):
         """See if the profile data was parsed correctly, and print info
@@ -551,18 +815,12 @@ class Profile:
         existence of var_to_check (i.e., var_to_check must be present
         either in all profiles or in none).
 
-        If optflag is not set (i.e., this is the first profile), then
-        set optflag to True or False depending on the existence of
-        var_to_check. If optflag is already set (for consequent
-        profiles), var_to_check must (if optflag is True) or must not
-        (if optflag is False) exist. If not so, raise ProfileError.
+        The session-wide optflag is resolved before any profile is
+        processed (see main.resolve_session_options()). If optflag is
+        True, var_to_check must exist; if it is False, var_to_check
+        must not exist. If not so, raise ProfileError.
         """
-        if not hasattr(self.opt, optflag):
-            if self.__dict__[var_to_check]:
-                self.opt.__dict__[optflag] = True
-            else:
-                self.opt.__dict__[optflag] = False
-        if self.opt.__dict__[optflag]:
+        if getattr(self.opt, optflag):
             if self.__dict__[var_to_check]:
                 sys.stdout.write("  %s: yes\n" % var_str)
             else:
@@ -577,24 +835,18 @@ class Profile:
         value of var_to_check (i.e., var_to_check must be present and
         have equal value in all profiles).
 
-        If optvar is not set (i.e., this is the first profile), then
-        set optflag to the value of var_to_check. If optvar is already
-        set (for consequent profiles), the value of var_to_check must
-        be equal to that of optvar. If not so, raise ProfileError.
+        The session-wide optvar is resolved before any profile is
+        processed (see main.resolve_session_options()). The value of
+        var_to_check must be equal to that of optvar. If not so, raise
+        ProfileError.
         """
         if not self.__dict__[var_to_check]:
             raise ProfileError(self, "%s not found in input file" % var_str)
-        if not hasattr(self.opt, optvar):
-            self.opt.__dict__[optvar] = self.__dict__[var_to_check]
-        elif self.__dict__[var_to_check] == self.opt.__dict__[optvar]:
-            pass  # really no point in pointing out that it's ok
-            # sys.stdout.write("  %s: %s\n"
-            #                  % (var_str, parent.__dict__[var_to_check]))
-        else:
+        if self.__dict__[var_to_check] != getattr(self.opt, optvar):
             raise ProfileError(self, "%s value '%s'  differs from the value "
                                      "specified ('%s') in the first input file"
                                % (var_str, self.__dict__[var_to_check],
-                                  self.opt.__dict__[optvar]))
+                                  getattr(self.opt, optvar)))
 
     def __check_paths(self):
         """Check if profile border and holes intersect with themselves."""
@@ -623,27 +875,57 @@ class Profile:
                                        % (n + 1, n + n2 + 2))
         sys.stdout.write("  Paths are ok.\n")
  
-    def __get_coords(self, strli, coord_type=""):
-        """ Pop point coordinates from list strli.
-            When an element of strli is not a valid point,
-            a warning is issued.
+    def __get_coords(self, lines, coord_type=""):
+        """ Read point coordinates from lines (a file_io.LineReader), up
+            to and including the line with 'END'. When a line is not a
+            valid point, a warning is issued.
+
+            The lines are read and converted in blocks; only blocks that
+            contain invalid or commented lines are converted line by
+            line.
         """
+        def add_point(c):
+            # Particles must be unique within the whole block; other
+            # points only need to differ from the previous point
+            if pointli and (c == last[0] or (seen is not None and c in seen)):
+                sys.stdout.write("Duplicate %s coordinates %s: skipping "
+                                 "2nd instance\n" % (coord_type, geometry.Point(*c)))
+                return
+            pointli.append(geometry.Point(*c))
+            last[0] = c
+            if seen is not None:
+                seen.add(c)
+
         pointli = []
-        s = strli.pop(0).replace('\n', '').replace(' ', '').strip()
-        while s != 'END':
+        last = [None]
+        seen = set() if coord_type == 'particle' else None
+        end_found = False
+        while not end_found:
+            block = lines.read_block(COORD_BLOCK_SIZE)
+            if not block:
+                raise ProfileError(self, "END of %s coordinates not found" % coord_type)
+            strli = [s.strip() for s in block]
             try:
-                p = geometry.Point(float(s.split(',')[0]), float(s.split(',')[1]))
-                if pointli and (p == pointli[-1] or (coord_type == 'particle' and p in pointli)):
-                    sys.stdout.write("Duplicate %s coordinates %s: skipping "
-                                     "2nd instance\n" % (coord_type, p))
-                else:
-                    pointli.append(Point(p.x, p.y, ptype=coord_type))
+                end = strli.index('END')
+                lines.unread(block[end + 1:])
+                del strli[end:]
+                end_found = True
             except ValueError:
-                if s[0] != '#':
-                    profile_warning(self, "'%s' not valid %s coordinates" % (s, coord_type))
-                else:
-                    pass 
-            s = strli.pop(0).replace('\n', '').strip()
+                pass
+            coords = bulk_coords(strli)
+            if coords is not None:
+                for c in coords:
+                    add_point(c)
+                continue
+            for s in strli:
+                try:
+                    c = s.split(',')
+                    c = (float(c[0]), float(c[1]))
+                except (IndexError, ValueError):
+                    if s and s[0] != '#':
+                        profile_warning(self, "'%s' not valid %s coordinates" % (s, coord_type))
+                    continue
+                add_point(c)
         # For some reason, sometimes the endnodes have the same coordinates;
         # in that case, delete the last endnode to avoid division by zero
         if (len(pointli) > 1) and (pointli[0] == pointli[-1]): 
@@ -733,6 +1015,11 @@ class OptionData:
         self.output_file_format = 'excel'
         self.output_filename_ext = '.xlsx'
         self.input_filename_ext = '.dtp'
+        self.preparsed_filename_ext = file_io.PREPARSED_FILENAME_EXT
+        self.save_preparsed_profiles = False
+        self.timing_summary = False
+        self.single_output_file = False
+        self.output_database = ''
         self.output_filename_suffix = ''
         self.output_filename_other_suffix = ''
         self.output_filename_date_suffix = True
@@ -757,6 +1044,17 @@ class OptionData:
                                      'simulated - simulated': False}
         self.interpoint_shortest_dist = True
         self.interpoint_lateral_dist = False
+        self.processes = 1
+        self.cache_dir = ''
+        self.cache_max_size = 1000
+        self.prefetch_depth = 2
+        # In the GUI, keep the results of the last session in a temporary
+        # results file, so that its summaries can be saved again (see
+        # main.get_session_results()); off by default, as all processed
+        # profiles are then written to disk
+        self.keep_session_results = False
+        self.results_file = ''
+        self.trace_file = ''
 
     def reset(self):
         """ Resets all options to default, and removes those that are not
@@ -764,19 +1062,305 @@ class OptionData:
         """
         self.__dict__ = {}
         self.__init__()
+
+    def read_config(self, configfn, warn=None):
+        """ Read options from the 'Options' section of the configuration
+            file configfn. Invalid values are replaced by defaults, and
+            reported by calling warn (if given) with a message string.
+        """
+
+        def show_warning(s):
+            if warn is not None:
+                warn(s)
+
+        def show_invalid_option_warning(invalid_opt):
+            show_warning("Invalid value '%s' for option '%s' in "
+                         "configuration file '%s'.\nUsing default value."
+                         % (getattr(self, invalid_opt), invalid_opt, configfn))
+
+        def check_str_option(opt, valid_strings=()):
+            if getattr(self, opt) not in valid_strings:
+                show_invalid_option_warning(opt)
+                setattr(self, opt, getattr(defaults, opt))
+
+        def check_int_option(opt, lower=None, upper=None):
+            try:
+                setattr(self, opt, stringconv.str_to_int(getattr(self, opt), lower, upper))
+            except ValueError:
+                show_invalid_option_warning(opt)
+                setattr(self, opt, getattr(defaults, opt))
+
+        def check_bool_option(opt):
+            try:
+                setattr(self, opt, stringconv.str_to_bool(getattr(self, opt)))
+            except ValueError:
+                show_invalid_option_warning(opt)
+                setattr(self, opt, getattr(defaults, opt))
+
+        def check_bool_dict_option(opt):
+            optdict = getattr(self, opt)
+            defaultdict = getattr(defaults, opt)
+            for key, val in list(optdict.items()):
+                optstr = '.'.join([opt, key.replace(" ", "_")])
+                if key not in list(getattr(defaults, opt).keys()):
+                    show_warning("Invalid option '%s' in configuration file '%s'."
+                                 % (optstr, configfn))
+                    del optdict[key]
+                try:
+                    optdict[key] = stringconv.str_to_bool(val)
+                except ValueError:
+                    show_warning("Invalid value '%s' for option '%s' in "
+                                 "configuration file '%s'.\nUsing default "
+                                 "value." % (val, optstr, configfn))
+                    optdict[key] = defaultdict[key]
+
+        import configparser
+        config = configparser.ConfigParser()
+        if not os.path.exists(configfn):
+            return
+        try:
+            config.read(configfn)
+        except (configparser.ParsingError, configparser.MissingSectionHeaderError):
+            return     # Silently suppress parsing errors at this stage
+        if 'Options' not in config.sections():
+            return     # No options present in config file; silently use defaults
+        defaults = OptionData()
+        for option in config.options('Options'):
+            if '.' in option:
+                option_dict, option_key = option.split('.', 1)
+                option_key = option_key.replace("_", " ")
+                try:
+                    getattr(self, option_dict)[option_key] = config.get('Options', option)
+                except AttributeError:
+                    pass   # So, attribute is invalid, but continue silently
+            else:
+                setattr(self, option, config.get('Options', option))
+        check_str_option('output_file_format', ('excel', 'csv', 'npz', 'feather', 'sqlite'))
+        check_str_option('csv_delimiter', ('comma', 'tab'))
+        check_str_option('action_if_output_file_exists', ('enumerate', 'overwrite'))
+        check_bool_option('output_filename_date_suffix')
+        check_int_option('spatial_resolution', lower=0, upper=1000)
+        check_int_option('shell_width', lower=0, upper=1000)
+        check_bool_option('determine_clusters')
+        check_int_option('within_cluster_dist', lower=1, upper=1000)
+        check_bool_option('run_monte_carlo')
+        check_int_option('monte_carlo_runs', lower=1, upper=999)
+        check_bool_option('determine_interpoint_dists')
+        check_str_option('monte_carlo_simulation_window', ('shell', 'positive shell',
+                                                           'negative shell'))
+        check_str_option('interpoint_dist_mode', ('nearest neighbour', 'all'))
+        check_bool_option('interpoint_shortest_dist')
+        check_bool_option('interpoint_lateral_dist')
+        check_int_option('processes', lower=0, upper=1000)
+        check_int_option('cache_max_size', lower=0)
+        check_int_option('prefetch_depth', lower=0, upper=100)
+        check_bool_option('save_preparsed_profiles')
+        check_bool_option('single_output_file')
+        check_bool_option('timing_summary')
+        check_bool_option('keep_session_results')
+        check_bool_dict_option('interpoint_relations')
+        check_bool_dict_option('outputs')
+
+    def write_config(self, configfn):
+        """ Write options to the 'Options' section of the configuration
+            file configfn, keeping other sections of the file. Raise
+            IOError if the file could not be written.
+        """
+
+        def set_option(option):
+            config['Options'][option] = str(getattr(self, option))
+
+        def set_dict_option(option):
+            optdict = getattr(self, option)
+            for key, val in list(optdict.items()):
+                optstr = '.'.join([option, key.replace(' ', '_')])
+                config['Options'][optstr] = str(val)
+
+        import configparser
+        config = configparser.ConfigParser()
+        try:
+            config.read(configfn)
+        except (configparser.ParsingError, configparser.MissingSectionHeaderError):
+            pass  # Silently suppress parsing errors at this stage
+        if 'Options' not in config.sections():
+            config['Options'] = {}
+        set_option('output_file_format')
+        set_option('csv_delimiter')
+        set_option('action_if_output_file_exists')
+        set_option('output_filename_date_suffix')
+        set_option('spatial_resolution')
+        set_option('shell_width')
+        set_option('determine_clusters')
+        set_option('within_cluster_dist')
+        set_option('run_monte_carlo')
+        set_option('monte_carlo_runs')
+        set_option('determine_interpoint_dists')
+        set_option('monte_carlo_simulation_window')
+        set_option('interpoint_dist_mode')
+        set_option('interpoint_shortest_dist')
+        set_option('interpoint_lateral_dist')
+        set_option('processes')
+        set_option('cache_dir')
+        set_option('output_database')
+        set_option('cache_max_size')
+        set_option('prefetch_depth')
+        set_option('save_preparsed_profiles')
+        set_option('single_output_file')
+        set_option('timing_summary')
+        set_option('keep_session_results')
+        set_dict_option('interpoint_relations')
+        set_dict_option('outputs')
+        with open(configfn, 'w') as f:
+            config.write(f)
 # end of class OptionData
 
 
+class FrozenOptionData:
+    """ Read-only snapshot of an OptionData instance, taken when the
+        session-wide options have been resolved. It can be shared by
+        profiles that are processed concurrently or out of order.
+
+        The exception is stop_requested, which is read from and written
+        to the OptionData instance that the snapshot was taken from.
+    """
+    def __init__(self, opt):
+        options = copy.deepcopy(dict((key, val) for key, val in opt.__dict__.items()
+                                     if key != 'stop_requested'))
+        object.__setattr__(self, '_options', options)
+        object.__setattr__(self, '_source', opt)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name == 'stop_requested':
+            return self._source.stop_requested
+        try:
+            val = self._options[name]
+        except KeyError:
+            raise AttributeError(name)
+        if isinstance(val, dict):
+            return types.MappingProxyType(val)
+        return val
+
+    def __setattr__(self, name, val):
+        if name != 'stop_requested':
+            raise AttributeError("session options are read-only")
+        self._source.stop_requested = val
+
+    def __delattr__(self, name):
+        raise AttributeError("session options are read-only")
+# end of class FrozenOptionData
+
+
 class ProfileError(Exception):
     def __init__(self, profile, msg):
         self.profile = profile
         self.msg = msg + "."
 
 
+# Number of coordinate lines that are read and converted at a time
+COORD_BLOCK_SIZE = 4096
+
+# Lines of the form 'x, y', separated by newlines
+_coord_block_re = re.compile(r"[^,\n]*,[^,\n]*(?:\n[^,\n]*,[^,\n]*)*")
+
+
+def bulk_coords(strli):
+    """ Convert a list of stripped 'x, y' strings to a list of (x, y)
+        tuples of floats in one go. Return None if any of the strings is
+        not of that form (for example, if it is commented out), so that
+        the strings can be examined one by one instead.
+    """
+    if not strli:
+        return []
+    text = '\n'.join(strli)
+    if not _coord_block_re.fullmatch(text):
+        return None
+    try:
+        vals = iter(list(map(float, text.replace('\n', ',').split(','))))
+    except ValueError:
+        return None
+    return list(zip(vals, vals))
+
+
+def parse_posloc(s):
+    """ Return the point given by s, the argument of a POSLOC line of an
+        input file; raise ValueError if it is not valid
+    """
+    x, y = s.split(', ')
+    return geometry.Point(float(x), float(y))
+
+
+def is_preparsed(inputfn):
+    """ Return True if inputfn is a pre-parsed profile file (as opposed
+        to a text input file).
+    """
+    return file_io.split_input_ext(inputfn)[1] == file_io.PREPARSED_FILENAME_EXT
+
+
+def scan_header(inputfn):
+    """ Quickly scan an input file for the data that decide
+        session-wide options, without parsing any coordinates. Return a
+        dict with the metric unit and whether polarity (POSLOC) and
+        random points are present, or None if the file could not be
+        read or its pixel width or POSLOC is invalid (in which case it
+        would not be processed).
+    """
+    header = {'metric_unit': None, 'use_polarity': False, 'use_random': False}
+    if is_preparsed(inputfn):
+        try:
+            meta = file_io.read_preparsed(inputfn, with_arrays=False)[0]
+            header['metric_unit'] = meta['metric_unit']
+            header['use_polarity'] = meta['posloc'] is not None
+            header['use_random'] = meta['counts']['random'] > 0
+        except (IOError, ValueError, KeyError, TypeError):
+            return None
+        return header if header['metric_unit'] else None
+    try:
+        f = file_io.open_input(inputfn)
+    except IOError:
+        return None
+    with f:
+        in_random_block = False
+        for s in f:
+            s = s.strip()
+            if in_random_block:
+                # As in Profile.__get_coords(), only 'END' ends the block
+                if s == 'END':
+                    in_random_block = False
+                elif not header['use_random']:
+                    try:
+                        x, y = s.split(',')[:2]
+                        float(x), float(y)
+                        header['use_random'] = True
+                    except ValueError:
+                        pass
+                continue
+            keyword = s.split(' ')[0].upper()
+            if keyword == 'PIXELWIDTH':
+                try:
+                    float(s.split(' ')[1])
+                    header['metric_unit'] = s.split(' ')[2]
+                except (IndexError, ValueError):
+                    return None
+            elif keyword == 'POSLOC':
+                try:
+                    parse_posloc(s.partition(' ')[2])
+                except ValueError:
+                    return None
+                header['use_polarity'] = True
+            elif s.upper() == 'RANDOM_POINTS':
+                in_random_block = True
+    if not header['metric_unit']:
+        return None
+    return header
+
+
 def profile_warning(profile, msg):
     """ Issue a warning
     """
     sys.stdout.write("Warning: %s.\n" % msg)
+    profile.warnli.append(msg)
     profile.warnflag = True      
 
 
@@ -0,0 +1,225 @@
+#
+#    SQLite database of results:
+#
+#    Stores the summaries of a session as tables in an SQLite database,
+#    in which each row is keyed by session, profile id and input file.
+#    Repeated sessions are appended to the same database, so that results
+#    from several sessions (studies) can be queried together.
+#
+#    All rows of a session are inserted in a single transaction, which is
+#    committed when the database is closed, and rolled back if the
+#    session is discarded.
+
+import datetime
+import os.path
+import sqlite3
+
+DATABASE_FILENAME_EXT = '.sqlite'
+
+DatabaseError = sqlite3.Error
+
+# Tables holding a summary in which each row ends with profile id, input
+# file and comment (see main.SummaryWriter); the remaining columns, in the
+# order in which they appear in the summary, are given here
+SUMMARY_TABLES = {
+    'profile summary': ('profile_summary', (
+        ('path_length', 'REAL'),
+        ('particles_total', 'INTEGER'),
+        ('positive_particles', 'INTEGER'),
+        ('positive_shell_particles', 'INTEGER'),
+        ('negative_shell_particles', 'INTEGER'),
+        ('shell_particles_positive_or_within_resolution', 'INTEGER'),
+        ('particles_within_resolution', 'INTEGER'))),
+    'particle.summary': ('particle_summary', (
+        ('particle_number', 'INTEGER'),
+        ('dist_to_path', 'REAL'),
+        ('lateral_dist_to_path_center', 'REAL'),
+        ('lateral_dist_to_path_center_rel', 'REAL'),
+        ('associated_with_path', 'INTEGER'),
+        ('path_length', 'REAL'))),
+    'random.summary': ('random_summary', (
+        ('point_number', 'INTEGER'),
+        ('dist_to_path', 'REAL'),
+        ('lateral_dist_to_path_center', 'REAL'),
+        ('lateral_dist_to_path_center_rel', 'REAL'),
+        ('associated_with_path', 'INTEGER'),
+        ('path_length', 'REAL'))),
+    'cluster.summary': ('cluster_summary', (
+        ('cluster_number', 'INTEGER'),
+        ('particles_in_cluster', 'INTEGER'),
+        ('centroid_dist_to_path', 'REAL'),
+        ('dist_to_nearest_cluster', 'REAL'))),
+    'simulated.cluster.summary': ('simulated_cluster_summary', (
+        ('particles_in_cluster', 'INTEGER'),
+        ('run', 'INTEGER'),
+        ('centroid_dist_to_path', 'REAL'),
+        ('dist_to_nearest_cluster', 'REAL'))),
+}
+
+# Tables in long format (one row per distance)
+DISTANCE_TABLES = {
+    'interpoint_distances': (
+        ('relation', 'TEXT'),
+        ('distance_type', 'TEXT'),
+        ('distance', 'REAL')),
+    'simulated_path_distances': (
+        ('run', 'INTEGER'),
+        ('distance', 'REAL')),
+    'simulated_interpoint_distances': (
+        ('relation', 'TEXT'),
+        ('distance_type', 'TEXT'),
+        ('run', 'INTEGER'),
+        ('distance', 'REAL')),
+}
+
+# Wall and CPU time (in seconds) of each stage of processing a profile;
+# stages of the session as a whole have no profile id or input file
+TIMING_COLUMNS = (('stage', 'TEXT'),
+                  ('wall_time', 'REAL'),
+                  ('cpu_time', 'REAL'))
+
+KEY_COLUMNS = (('session_id', 'INTEGER'),
+               ('profile_id', ''),
+               ('input_file', 'TEXT'))
+
+
+def database_filename(opt):
+    """ Return the name of the database file to use """
+    if opt.output_database:
+        return opt.output_database
+    return os.path.join(opt.output_dir, "summaries" + DATABASE_FILENAME_EXT)
+
+
+def _value(element):
+    """ Return element as stored in the database """
+    if element in ("N/A", ""):
+        return None
+    if element == "yes":
+        return 1
+    if element == "no":
+        return 0
+    return element
+
+
+class ResultDatabase:
+    """ The summaries of a session, stored in an SQLite database """
+    def __init__(self, fn):
+        """ Open (or create) the database fn and start a session in it;
+            raise DatabaseError if unable to
+        """
+        self.fn = fn
+        self.created = not os.path.exists(fn)
+        self.conn = sqlite3.connect(fn)
+        try:
+            self.__create_tables()
+            cur = self.conn.execute("INSERT INTO sessions (started) VALUES (?)",
+                                    (datetime.datetime.now().isoformat(" ", "seconds"),))
+        except DatabaseError:
+            self.discard()
+            raise
+        self.session_id = cur.lastrowid
+
+    def __create_tables(self):
+        def create(table, columns, index=True):
+            self.conn.execute("CREATE TABLE IF NOT EXISTS %s (%s)" % (
+                table, ", ".join(("%s %s" % col).strip() for col in columns)))
+            if index:
+                self.conn.execute("CREATE INDEX IF NOT EXISTS %s_key ON %s "
+                                  "(session_id, profile_id, input_file)" % (table, table))
+
+        create("sessions", (("session_id", "INTEGER PRIMARY KEY"),
+                            ("started", "TEXT"),
+                            ("program_version", "TEXT"),
+                            ("metric_unit", "TEXT"),
+                            ("spatial_resolution", "INTEGER"),
+                            ("evaluated_profiles", "INTEGER")), index=False)
+        create("session_files", (("session_id", "INTEGER"),
+                                 ("input_file", "TEXT"),
+                                 ("status", "TEXT")), index=False)
+        create("profiles", KEY_COLUMNS + (("comment", "TEXT"),))
+        self.conn.execute("CREATE INDEX IF NOT EXISTS profiles_input_file "
+                          "ON profiles (input_file)")
+        for table, columns in SUMMARY_TABLES.values():
+            create(table, KEY_COLUMNS + columns)
+        for table, columns in DISTANCE_TABLES.items():
+            create(table, KEY_COLUMNS + columns)
+        create("timings", KEY_COLUMNS + TIMING_COLUMNS)
+
+    def __insert(self, table, ncols, rows):
+        self.conn.executemany("INSERT INTO %s VALUES (%s)"
+                              % (table, ", ".join("?" * ncols)), rows)
+
+    def add_profile(self, key, comment):
+        """ Add the profile with key (profile id, input file) """
+        self.__insert("profiles", 4, [(self.session_id,) + key + (comment,)])
+
+    def add_summary_rows(self, main_name, key, rows):
+        """ Add the rows of summary main_name for the profile with key """
+        table, columns = SUMMARY_TABLES[main_name]
+        keys = (self.session_id,) + key
+        self.__insert(table, len(KEY_COLUMNS) + len(columns),
+                      [keys + tuple(_value(e) for e in row[:-3]) for row in rows])
+
+    def add_interpoint_distances(self, key, relation, dist_type, distli):
+        """ Add the interpoint distances in distli of the profile with key """
+        keys = (self.session_id,) + key + (relation, dist_type)
+        self.__insert("interpoint_distances", 6,
+                      [keys + (_value(d),) for d in distli])
+
+    def add_simulated_distances(self, key, rows, relation=None, dist_type=None):
+        """ Add distances of simulated points of the profile with key,
+            given as rows with a column for each Monte Carlo run: the
+            distances to the path, or if relation is given, interpoint
+            distances of type dist_type
+        """
+        if relation is None:
+            table, keys = "simulated_path_distances", (self.session_id,) + key
+        else:
+            table = "simulated_interpoint_distances"
+            keys = (self.session_id,) + key + (relation, dist_type)
+        self.__insert(table, len(keys) + 2,
+                      [keys + (run, d)
+                       for row in rows
+                       for run, d in enumerate(row, start=1) if d is not None])
+
+    def add_timings(self, key, timings):
+        """ Add timings, a dict of stage: [wall time, CPU time], of the
+            profile with key
+        """
+        keys = (self.session_id,) + key
+        self.__insert("timings", 6,
+                      [keys + (stage, t[0], t[1]) for stage, t in timings.items()])
+
+    def add_session(self, version, metric_unit, spatial_resolution,
+                    n_evaluated, file_statusli):
+        """ Record the session; file_statusli is a list of (input file,
+            status) pairs
+        """
+        self.conn.execute("UPDATE sessions SET program_version = ?, metric_unit = ?, "
+                          "spatial_resolution = ?, evaluated_profiles = ? "
+                          "WHERE session_id = ?",
+                          (version, metric_unit, spatial_resolution, n_evaluated,
+                           self.session_id))
+        self.__insert("session_files", 3,
+                      [(self.session_id,) + fs for fs in file_statusli])
+
+    def commit(self):
+        """ Commit the session so far """
+        self.conn.commit()
+
+    def close(self):
+        """ Commit the session and close the database """
+        try:
+            self.conn.commit()
+        finally:
+            self.conn.close()
+
+    def discard(self):
+        """ Roll back the session and close the database """
+        self.conn.rollback()
+        self.conn.close()
+        if self.created:
+            try:
+                os.remove(self.fn)
+            except OSError:
+                pass
@@ -1,16 +1,35 @@
-import codecs
+import array
+import collections
+import io
+import itertools
 import os.path
+import queue
 import sys
+import threading
+
+# Output formats in which each summary is stored as typed columns
+COLUMNAR_FORMATS = ('npz', 'feather')
+
+# Size of the write buffer of csv output files
+CSV_BUFFER_SIZE = 1 << 20
 
 
 class FileWriter:
-    def __init__(self, main_name, opt):
+    def __init__(self, main_name, opt, container=None):
+        """Writer of the output file main_name; or, if container (a
+           SummaryContainer) is given, of a part of that file"""
         self.main_name = main_name
         self.opt = opt
+        self.container = container
         self.fn = ""
         self.f = None
 
-    def __enter__(self):
+    def open(self):
+        """Open the output file and return a writer for it"""
+        if self.container is not None:
+            self.f = self.container.add(self.main_name)
+            self.fn = self.container.fn
+            return self.f
         self.fn = os.path.join(self.opt.output_dir,
                                self.main_name +
                                self.opt.output_filename_suffix +
@@ -19,16 +38,27 @@ class FileWriter:
                 self.opt.action_if_output_file_exists == 'enumerate'):
                 self.fn = enum_filename(self.fn, 2)
         if self.opt.output_file_format == 'csv':
-            import csv
-            self.f = csv.writer(open(self.fn, 'w'), **self.opt.csv_format)
+            self.f = CsvWriter(self.fn, self.opt.csv_format)
         elif self.opt.output_file_format == 'excel':
             from . import xls
             self.f = xls.Writer(self.fn)
+        elif self.opt.output_file_format in COLUMNAR_FORMATS:
+            from . import columnar
+            self.f = columnar.Writer(self.fn, self.opt.output_file_format)
         return self.f
 
-    def __exit__(self, _type, _val, tb):
+    def close(self, failed=False):
+        """Close the output file and report whether it was saved
+           (which it is not if failed is True; what was written is then
+           kept, e.g. for debugging)"""
+        if self.container is not None:
+            return      # Saved when the container is closed
         try:
-            if tb is not None:
+            if failed:
+                try:
+                    self.f.close()
+                except Exception:
+                    pass
                 raise IOError
             self.f.close()
             sys.stdout.write("Saved '%s'.\n" % self.fn)
@@ -37,6 +67,141 @@ class FileWriter:
             sys.stdout.write("Error: Unable to save to file '%s'\n" % self.fn)
             self.opt.save_result['any_err'] = True
 
+    def discard(self):
+        """Close the output file without reporting, and remove it"""
+        if self.container is not None:
+            return
+        # Whatever the writer, and whatever state it is in, the file is
+        # to be removed, so errors when closing it do not matter
+        try:
+            close = getattr(self.f, 'close', None)
+            if close is not None:
+                close()
+        except Exception:
+            pass
+        try:
+            os.remove(self.fn)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, _type, _val, tb):
+        self.close(failed=tb is not None)
+
+
+class CsvWriter:
+    """A csv writer that owns its output file, which is written through
+       a large buffer and flushed and closed by close()"""
+    def __init__(self, fn, csv_format):
+        import csv
+        self.fn = fn
+        self.fh = open(fn, 'w', buffering=CSV_BUFFER_SIZE)
+        self.w = csv.writer(self.fh, **csv_format)
+
+    def writerow(self, row):
+        self.w.writerow(row)
+
+    def writerows(self, rows):
+        self.w.writerows(rows)
+
+    def close(self):
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, _val, tb):
+        self.close()
+
+
+class SummaryContainer:
+    """A single output file holding several summaries: as sheets of an
+       Excel workbook, or as csv (or .npz or Feather) files in a zip
+       archive. The file is created when the first summary is added, and
+       written when the container is closed.
+    """
+    def __init__(self, main_name, opt):
+        self.main_name = main_name
+        self.opt = opt
+        self.fn = ""
+        self.f = None
+        self.members = []
+
+    def __create(self):
+        if self.opt.output_file_format == 'excel':
+            ext = self.opt.output_filename_ext
+        else:
+            ext = '.zip'
+        self.fn = os.path.join(self.opt.output_dir,
+                               self.main_name + self.opt.output_filename_suffix + ext)
+        if (os.path.exists(self.fn) and
+                self.opt.action_if_output_file_exists == 'enumerate'):
+            self.fn = enum_filename(self.fn, 2)
+        if self.opt.output_file_format == 'excel':
+            from . import xls
+            self.f = xls.MultiSheetWriter(self.fn)
+
+    def add(self, main_name):
+        """Add the summary main_name, and return a writer for it"""
+        if not self.fn:
+            self.__create()
+        if self.opt.output_file_format == 'excel':
+            return self.f.add_sheet(main_name)
+        import tempfile
+        # Spooled to a temporary file, as the members of a zip archive
+        # cannot be written to in turn
+        name = main_name + self.opt.output_filename_suffix
+        if self.opt.output_file_format in COLUMNAR_FORMATS:
+            from . import columnar
+            f = tempfile.TemporaryFile()
+            w = columnar.Writer(f, self.opt.output_file_format)
+            self.members.append((name + self.opt.output_filename_ext, f, f, w.close))
+            return w
+        import csv
+        f = io.TextIOWrapper(tempfile.TemporaryFile(buffering=CSV_BUFFER_SIZE))
+        self.members.append((name + '.csv', f, f.buffer, f.flush))
+        return csv.writer(f, **self.opt.csv_format)
+
+    def close(self):
+        """Write the file and report whether it was saved"""
+        if not self.fn:
+            return
+        try:
+            if self.opt.output_file_format == 'excel':
+                self.f.close()
+            else:
+                import shutil
+                import zipfile
+                with zipfile.ZipFile(self.fn, 'w', zipfile.ZIP_DEFLATED) as zf:
+                    for name, f, buf, finish in self.members:
+                        finish()
+                        buf.seek(0)
+                        with zf.open(name, 'w', force_zip64=True) as member:
+                            shutil.copyfileobj(buf, member)
+            sys.stdout.write("Saved '%s'.\n" % self.fn)
+            self.opt.save_result['any_saved'] = True
+        except IOError:
+            sys.stdout.write("Error: Unable to save to file '%s'\n" % self.fn)
+            self.opt.save_result['any_err'] = True
+        finally:
+            self.__close_members()
+
+    def discard(self):
+        """Discard the summaries without writing the file"""
+        self.__close_members()
+        if self.fn and os.path.exists(self.fn):
+            try:
+                os.remove(self.fn)
+            except OSError:
+                pass
+
+    def __close_members(self):
+        for name, f, buf, finish in self.members:
+            f.close()
+        self.members = []
+
 
 def enum_filename(fn, n):
     """Return a unique numbered filename based on fn"""
@@ -48,15 +213,352 @@ def enum_filename(fn, n):
         return newfn
 
 
-def read_file(fname):
-    """Open file named fname and read its lines into a list"""
+# Text input files at least this large (in bytes) are memory-mapped
+MMAP_THRESHOLD = 64 * 1024 * 1024
+# Number of bytes of a memory-mapped file that are decoded at a time
+MMAP_CHUNK_SIZE = 1024 * 1024
+
+
+# Archives from which each member with an input file extension is read
+# as a separate input file
+ARCHIVE_EXTS = ('.zip', '.tar', '.tar.gz', '.tgz')
+# Extension of single gzip-compressed input files (e.g. 'profile.dtp.gz')
+COMPRESSED_EXT = '.gz'
+# Separates the archive and member names of an input file in an archive
+MEMBER_SEP = '!'
+
+
+def is_archive(fname):
+    """Return True if fname is the name of an archive (rather than of a
+       member of one)"""
+    return fname.lower().endswith(ARCHIVE_EXTS)
+
+
+def split_member(fname):
+    """Split fname into the name of an archive and the name of a member
+       of that archive, e.g. 'data/study.zip!p1.dtp' into
+       ('data/study.zip', 'p1.dtp'). If fname does not refer to a
+       member of an archive, return (fname, None).
+    """
+    i = fname.find(MEMBER_SEP)
+    while i != -1:
+        if is_archive(fname[:i]):
+            return fname[:i], fname[i + 1:]
+        i = fname.find(MEMBER_SEP, i + 1)
+    return fname, None
+
+
+def split_input_ext(fname):
+    """Like os.path.splitext(), but ignore the extension of a compressed
+       input file, so that 'profile.dtp.gz' gives ('profile', '.dtp')"""
+    if fname.lower().endswith(COMPRESSED_EXT) and not is_archive(fname):
+        fname = fname[:-len(COMPRESSED_EXT)]
+    return os.path.splitext(fname)
+
+
+def display_name(fname):
+    """Return the name by which the input file fname is reported in
+       output files: the base name of the file, or for a member of an
+       archive, the base name of the archive and the member name."""
+    archive, member = split_member(fname)
+    if member is None:
+        return os.path.basename(fname)
+    return os.path.basename(archive) + MEMBER_SEP + member
+
+
+def list_archive(fname, exts):
+    """Return the input file names of the members of archive fname
+       that have an extension in exts, in archive order. Raise IOError
+       if the archive could not be read.
+    """
+    import tarfile
+    import zipfile
     try:
-        f = codecs.open(fname, mode="r", encoding="utf-8", buffering=0)
+        if fname.lower().endswith('.zip'):
+            with zipfile.ZipFile(fname) as zf:
+                names = [info.filename for info in zf.infolist() if not info.is_dir()]
+        else:
+            with tarfile.open(fname) as tf:
+                names = [info.name for info in tf.getmembers() if info.isfile()]
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError):
+        raise IOError("Could not read archive '%s'" % fname)
+    return [fname + MEMBER_SEP + name for name in names
+            if split_input_ext(name)[1] in exts]
+
+
+# The archive that members were last read from, kept open (one per
+# thread) because the members of an archive are usually read in turn
+_open_archives = threading.local()
+
+
+def open_archive_member(archive, member):
+    """Open member of archive for reading bytes"""
+    import tarfile
+    import zipfile
+    if getattr(_open_archives, 'name', None) != archive:
+        close_archive()
+        try:
+            if archive.lower().endswith('.zip'):
+                handle = zipfile.ZipFile(archive)
+            else:
+                handle = tarfile.open(archive)
+        except (zipfile.BadZipFile, tarfile.TarError, EOFError):
+            raise IOError("Could not read archive '%s'" % archive)
+        _open_archives.name, _open_archives.handle = archive, handle
+    handle = _open_archives.handle
+    try:
+        if isinstance(handle, zipfile.ZipFile):
+            return handle.open(member)
+        f = handle.extractfile(member)
+    except (KeyError, zipfile.BadZipFile, tarfile.TarError, EOFError):
+        raise IOError("Could not read '%s' in archive '%s'" % (member, archive))
+    if f is None:
+        raise IOError("'%s' in archive '%s' is not a file" % (member, archive))
+    return f
+
+
+def close_archive():
+    """Close the archive kept open by open_archive_member() (in the
+       calling thread), if any"""
+    if getattr(_open_archives, 'name', None) is not None:
+        _open_archives.handle.close()
+        _open_archives.name = _open_archives.handle = None
+
+
+# Contents of input files that have been read ahead by a Prefetcher
+_prefetched = {}
+
+
+def open_input(fname, binary=False):
+    """Open input file named fname for reading text lines (or bytes,
+       if binary is True). fname may also be a gzip-compressed file or
+       refer to a member of an archive (see split_member()). Large text
+       files are memory-mapped."""
+    data = _prefetched.get(fname)
+    if data is not None:
+        f = io.BytesIO(data)
+        return f if binary else io.TextIOWrapper(f, encoding="utf-8")
+    archive, member = split_member(fname)
+    if member is not None:
+        f = open_archive_member(archive, member)
+        return f if binary else io.TextIOWrapper(f, encoding="utf-8")
+    if is_archive(fname):
+        raise IOError("'%s' is an archive" % fname)
+    if fname.lower().endswith(COMPRESSED_EXT):
+        import gzip
+        if binary:
+            return gzip.open(fname, mode="rb")
+        return gzip.open(fname, mode="rt", encoding="utf-8")
+    if binary:
+        return open(fname, mode="rb")
+    if os.path.getsize(fname) >= MMAP_THRESHOLD:
         try:
-            s = f.readlines()
+            return MappedTextFile(fname)
+        except (OSError, ValueError):
+            pass    # E.g., not a regular file; read it the usual way
+    return open(fname, mode="r", encoding="utf-8")
+
+
+class Prefetcher:
+    """Reads the contents of input files in a background thread, ahead
+       of the one being processed, so that reading (e.g. from a network
+       filesystem) overlaps with processing. Iterating over a Prefetcher
+       yields the input file names in turn; while the iteration is at a
+       file name, open_input() reads that file from memory.
+
+       At most depth files are held in memory in addition to the current
+       one. Files too large to be held (see MMAP_THRESHOLD) are not read
+       ahead, nor are files that could not be read (so that the error
+       is reported when the file is opened as usual). depth must be at
+       least 1; ValueError is raised otherwise.
+    """
+    def __init__(self, fnli, depth):
+        if depth < 1:
+            raise ValueError("prefetch depth must be at least 1")
+        self.fnli = list(fnli)
+        self.queue = queue.Queue(maxsize=depth)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.__read_ahead, daemon=True)
+        self.thread.start()
+
+    def __read_ahead(self):
+        try:
+            for fname in self.fnli:
+                if self.stop_event.is_set():
+                    return
+                self.queue.put((fname, self.__read(fname)))
         finally:
-            f.close()
-    except IOError:
-        sys.stdout.write("Error: File not found or unreadable")
-        return 0
-    return s
+            close_archive()
+
+    @staticmethod
+    def __read(fname):
+        try:
+            if (split_member(fname)[1] is None
+                    and not fname.lower().endswith(COMPRESSED_EXT)
+                    and os.path.getsize(fname) >= MMAP_THRESHOLD):
+                return None
+            with open_input(fname, binary=True) as f:
+                data = f.read(MMAP_THRESHOLD)
+                if f.read(1):
+                    return None
+            return data
+        except Exception:
+            # Whatever went wrong, it will be reported when the file is
+            # opened in the usual way
+            return None
+
+    def __iter__(self):
+        for __ in self.fnli:
+            fname, data = self.queue.get()
+            if data is not None:
+                _prefetched[fname] = data
+            try:
+                yield fname
+            finally:
+                _prefetched.pop(fname, None)
+
+    def close(self):
+        """Stop reading ahead and wait for the background thread"""
+        self.stop_event.set()
+        while self.thread.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self.thread.join()
+
+
+class MappedTextFile:
+    """Read-only text file that is memory-mapped instead of read into
+       buffers. Iterating over it yields its lines, each decoded only
+       when it is reached, so memory use does not depend on the size of
+       the file (the mapped pages are backed by the file itself).
+    """
+    def __init__(self, fname, encoding="utf-8"):
+        import mmap
+        self.encoding = encoding
+        self.f = open(fname, mode="rb")
+        try:
+            self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self.f.close()
+            raise
+
+    def __iter__(self):
+        # Decode a chunk of whole lines at a time; io.StringIO splits it
+        # into lines with the same newline handling as a text file
+        mm = self.mm
+        pos = 0
+        while pos < len(mm):
+            end = mm.rfind(b'\n', pos, pos + MMAP_CHUNK_SIZE) + 1
+            if end == 0:
+                end = mm.find(b'\n', pos + MMAP_CHUNK_SIZE) + 1 or len(mm)
+            yield from io.StringIO(mm[pos:end].decode(self.encoding), newline=None)
+            pos = end
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, _val, tb):
+        self.close()
+
+    def close(self):
+        self.mm.close()
+        self.f.close()
+
+
+class LineReader:
+    """Iterator over the lines of a text stream that can also return
+       lines in blocks, and take back lines that were read too far.
+    """
+    def __init__(self, f):
+        self.f = iter(f)
+        self.pending = collections.deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.pending:
+            return self.pending.popleft()
+        return next(self.f)
+
+    def read_block(self, n):
+        """Return a list of at most n lines; an empty list at end of
+           stream"""
+        block = []
+        while self.pending and len(block) < n:
+            block.append(self.pending.popleft())
+        block.extend(itertools.islice(self.f, n - len(block)))
+        return block
+
+    def unread(self, lines):
+        """Push back lines, to be read again before any other lines"""
+        self.pending.extendleft(reversed(lines))
+
+
+# Pre-parsed profile files are zip archives holding the metadata as JSON
+# and each coordinate list as little-endian float64 x, y pairs
+PREPARSED_FILENAME_EXT = '.dtpb'
+PREPARSED_FORMAT_VERSION = 1
+PREPARSED_META_NAME = 'profile.json'
+PREPARSED_ARRAY_EXT = '.f8'
+
+
+def write_preparsed(fname, meta, arrays):
+    """ Write a pre-parsed profile file. meta is a JSON-serializable
+        dict; arrays maps names to flat sequences of coordinates (x1, y1,
+        x2, y2, ...). Raise IOError if the file could not be written.
+    """
+    import json
+    import zipfile
+    meta = dict(meta, format=PREPARSED_FORMAT_VERSION,
+                counts={name: len(vals) // 2 for name, vals in arrays.items()})
+    try:
+        with zipfile.ZipFile(fname, 'w', zipfile.ZIP_STORED) as zf:
+            zf.writestr(PREPARSED_META_NAME, json.dumps(meta))
+            for name, vals in arrays.items():
+                a = array.array('d', vals)
+                if sys.byteorder == 'big':
+                    a.byteswap()
+                zf.writestr(name + PREPARSED_ARRAY_EXT, a.tobytes())
+    except (IOError, OSError):
+        try:
+            os.remove(fname)
+        except OSError:
+            pass
+        raise IOError("Could not write '%s'" % fname)
+
+
+def read_preparsed(fname, with_arrays=True):
+    """ Read a pre-parsed profile file. Return (meta, arrays), where
+        arrays maps names to array('d') objects of coordinates (empty if
+        with_arrays is False). Raise IOError if the file could not be
+        read, and ValueError if it is not a valid pre-parsed profile file.
+    """
+    import json
+    import zipfile
+    with open_input(fname, binary=True) as f:
+        try:
+            zf = zipfile.ZipFile(f)
+        except zipfile.BadZipFile:
+            raise ValueError("not a zip archive")
+        with zf:
+            try:
+                meta = json.loads(zf.read(PREPARSED_META_NAME).decode('utf-8'))
+                if meta.get('format') != PREPARSED_FORMAT_VERSION:
+                    raise ValueError("unsupported format version")
+                arrays = {}
+                if with_arrays:
+                    for name, n in meta['counts'].items():
+                        a = array.array('d')
+                        a.frombytes(zf.read(name + PREPARSED_ARRAY_EXT))
+                        if sys.byteorder == 'big':
+                            a.byteswap()
+                        if len(a) != 2 * n:
+                            raise ValueError("wrong number of coordinates")
+                        arrays[name] = a
+            except (KeyError, TypeError, AttributeError, UnicodeDecodeError,
+                    zipfile.BadZipFile):
+                raise ValueError("missing or invalid data")
+    return meta, arrays
@@ -11,7 +11,6 @@ from . import core
 from . import file_io
 from . import gui
 from . import main
-from . import stringconv
 from . import version
 
 
@@ -29,6 +28,7 @@ class Frame(gui.MainFrame):
         self.configfn = os.path.normpath(os.path.expanduser('~/.%s.cfg' % version.title.lower()))
         self.log = None
         self.exitcode = None
+        self.last_results = None
         self.get_input_dir_from_config()
         self.load_options_from_config()
         self.set_options_in_ui()
@@ -45,8 +45,12 @@ class Frame(gui.MainFrame):
             ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(appid)
 
     def OnAddFile(self, event):
-        dlg = wx.FileDialog(self, "Choose a file", os.getcwd(), "", "*%s"
-                            % self.opt.input_filename_ext,
+        wildcard = ";".join("*" + ext for ext in (self.opt.input_filename_ext,
+                                                  self.opt.input_filename_ext +
+                                                  file_io.COMPRESSED_EXT,
+                                                  self.opt.preparsed_filename_ext)
+                                                 + file_io.ARCHIVE_EXTS)
+        dlg = wx.FileDialog(self, "Choose a file", os.getcwd(), "", wildcard,
                             wx.FD_MULTIPLE | wx.FD_CHANGE_DIR)
         try:
             if dlg.ShowModal() == wx.ID_OK:
@@ -130,6 +134,10 @@ class Frame(gui.MainFrame):
         self.set_options_from_ui()
         if not self.set_log():
             return
+        self.opt.input_file_list = main.expand_archives(self.opt.input_file_list, self.opt)
+        if not self.opt.input_file_list:
+            self.show_warning("No input files found in the archive(s).")
+            return
         if (self.opt.determine_interpoint_dists and
             find_in_dict('simulated', self.opt.interpoint_relations) and
                 self.opt.monte_carlo_simulation_window != 'shell'):
@@ -141,17 +149,28 @@ class Frame(gui.MainFrame):
                                            "whereas simulated points are only generated in the "
                                            "window.\n\nContinue anyway?\n"):
                 return
+        reexport_results = None
+        if self.last_results is not None and self.last_results.matches(self.opt):
+            if self.yes_no_dialog("The input files and analysis options are the same as "
+                                  "in the previous session.\nSave the summaries of that "
+                                  "session with the current output options,\nwithout "
+                                  "processing the input files again?"):
+                reexport_results = self.last_results
+        if reexport_results is None and self.last_results is not None:
+            self.last_results.remove()
+            self.last_results = None
         self.StatusBar.SetStatusText("Processing...")
         self.exitcode = 1
         event_type = ""
-        msg = "Processing %s \n(File %d of %d)" % (os.path.basename(self.opt.input_file_list[0]), 1,
-                                                   len(self.opt.input_file_list))
+        msg = "Processing %s \n(File %d of %d)" \
+            % (file_io.display_name(self.opt.input_file_list[0]), 1,
+               len(self.opt.input_file_list))
         i = 0
         dlg = wx.ProgressDialog(version.title, msg,
                                 len(self.opt.input_file_list) + 2,
                                 parent=self,
                                 style=wx.PD_ELAPSED_TIME | wx.PD_REMAINING_TIME | wx.PD_CAN_ABORT)
-        pthread = ProcessThread(self.opt)            
+        pthread = ProcessThread(self.opt, reexport_results)
         pthread.start()
         while pthread.isAlive() or not pthread.process_queue.empty():
             if not pthread.process_queue.empty():
@@ -159,7 +178,7 @@ class Frame(gui.MainFrame):
                 if event_type == "new_file":
                     i += 1
                     msg = "Processing %s \n(File %d of %d)" \
-                        % (os.path.basename(data), i,
+                        % (file_io.display_name(data), i,
                            len(self.opt.input_file_list))
                 if event_type == "saving_summaries":
                     i += 1
@@ -192,6 +211,8 @@ class Frame(gui.MainFrame):
             dlg.Destroy()
             return
         # Processing finished.            
+        if pthread.session_results is not None:
+            self.last_results = pthread.session_results
         self.log.update()    
         if self.log.fn != "":
             self.StatusBar.SetStatusText("Logged to '" + self.log.fn + "'.")        
@@ -204,6 +225,9 @@ class Frame(gui.MainFrame):
                               "processing. See log for details.")
         elif pthread.exitcode == 3:
             self.show_warning("Session aborted by user.")
+        elif pthread.exitcode == 4:
+            self.show_error("Unable to read the results of the previous "
+                            "session. See log for details.")
             
     def OnAbout(self, event):
         dlg = AboutDialog(self)
@@ -214,6 +238,8 @@ class Frame(gui.MainFrame):
 
     def OnClose(self, event):
         self.save_input_dir_to_config()
+        if self.last_results is not None:
+            self.last_results.remove()
         sys.stdout = sys.__stdout__
         self.Destroy()
 
@@ -260,133 +286,16 @@ class Frame(gui.MainFrame):
                               % (inputdir, self.configfn))
 
     def save_options_to_config(self):
-
-        def set_option(option):
-            nonlocal config
-            config['Options'][option] = str(getattr(self.opt, option))
-
-        def set_dict_option(option):
-            nonlocal config
-            optdict = getattr(self.opt, option)
-            for key, val in list(optdict.items()):
-                optstr = '.'.join([option, key.replace(' ', '_')])
-                config['Options'][optstr] = str(val)
-
         self.set_options_from_ui()
-        config = configparser.ConfigParser()
         try:
-            config.read(self.configfn)
-        except (configparser.ParsingError, configparser.MissingSectionHeaderError):
-            pass  # Silently suppress parsing errors at this stage
-        if 'Options' not in config.sections():
-            config['Options'] = {}
-        set_option('output_file_format')
-        set_option('csv_delimiter')
-        set_option('action_if_output_file_exists')
-        set_option('output_filename_date_suffix')
-        set_option('spatial_resolution')
-        set_option('shell_width')
-        set_option('determine_clusters')
-        set_option('within_cluster_dist')
-        set_option('run_monte_carlo')
-        set_option('monte_carlo_runs')
-        set_option('determine_interpoint_dists')
-        set_option('monte_carlo_simulation_window')
-        set_option('interpoint_dist_mode')
-        set_option('interpoint_shortest_dist')
-        set_option('interpoint_lateral_dist')
-        set_dict_option('interpoint_relations')
-        set_dict_option('outputs')
-        try:
-            with open(self.configfn, 'w') as f:
-                config.write(f)
+            self.opt.write_config(self.configfn)
         except IOError:
             self.show_warning("Configuration file\n(%s)\ncould not be saved." % self.configfn)
+            return False
+        return True
 
     def load_options_from_config(self):
-
-        def show_invalid_option_warning(invalid_opt):
-            self.show_warning("Invalid value '%s' for option '%s' in "
-                              "configuration file '%s'.\nUsing default value."
-                              % (getattr(self.opt, invalid_opt), invalid_opt,
-                                 self.configfn))
-
-        def check_str_option(opt, valid_strings=()):
-            if getattr(self.opt, opt) not in valid_strings:
-                show_invalid_option_warning(opt)
-                setattr(self.opt, opt, getattr(defaults, opt))
-
-        def check_int_option(opt, lower=None, upper=None):
-            try:
-                setattr(self.opt, opt,
-                        stringconv.str_to_int(getattr(self.opt, opt), lower, upper))
-            except ValueError:
-                show_invalid_option_warning(opt)
-                setattr(self.opt, opt, getattr(defaults, opt))
-
-        def check_bool_option(opt):
-            try:
-                setattr(self.opt, opt, stringconv.str_to_bool(getattr(self.opt, opt)))
-            except ValueError:
-                show_invalid_option_warning(opt)
-                setattr(self.opt, opt, getattr(defaults, opt))
-
-        def check_bool_dict_option(opt):
-            optdict = getattr(self.opt, opt)
-            defaultdict = getattr(defaults, opt)
-            for key, val in list(optdict.items()):
-                optstr = '.'.join([opt, key.replace(" ", "_")])
-                if key not in list(getattr(defaults, opt).keys()):
-                    self.show_warning("Invalid option '%s' in configuration file '%s'."
-                                      % (optstr, self.configfn))
-                    del optdict[key]
-                try:
-                    optdict[key] = stringconv.str_to_bool(val)
-                except ValueError:
-                    self.show_warning("Invalid value '%s' for option '%s' in "
-                                      "configuration file '%s'.\nUsing default "
-                                      "value." % (val, optstr, self.configfn))
-                    optdict[key] = defaultdict[key]
-
-        config = configparser.ConfigParser()
-        if not os.path.exists(self.configfn):
-            return
-        try:
-            config.read(self.configfn)
-        except (configparser.ParsingError, configparser.MissingSectionHeaderError):
-            return     # Silently suppress parsing errors at this stage
-        if 'Options' not in config.sections():
-            return     # No options present in config file; silently use defaults
-        defaults = core.OptionData()
-        for option in config.options('Options'):
-            if '.' in option:
-                option_dict, option_key = option.split('.', 1)
-                option_key = option_key.replace("_", " ")
-                try:
-                    getattr(self.opt,
-                            option_dict)[option_key] = config.get('Options', option)
-                except AttributeError:
-                    pass   # So, attribute is invalid, but continue silently
-            else:
-                setattr(self.opt, option, config.get('Options', option))
-        check_str_option('output_file_format', ('excel', 'csv'))
-        check_str_option('csv_delimiter', ('comma', 'tab'))
-        check_str_option('action_if_output_file_exists', ('enumerate', 'overwrite'))
-        check_bool_option('output_filename_date_suffix')
-        check_int_option('spatial_resolution', lower=0, upper=1000)
-        check_int_option('shell_width', lower=0, upper=1000)
-        check_bool_option('determine_clusters')
-        check_int_option('within_cluster_dist', lower=1, upper=1000)
-        check_bool_option('run_monte_carlo')
-        check_int_option('monte_carlo_runs', lower=1, upper=999)
-        check_bool_option('determine_interpoint_dists')
-        check_str_option('monte_carlo_simulation_window', ('shell', 'positive shell',
-                                                           'negative shell'))
-        check_str_option('interpoint_dist_mode', ('nearest neighbour', 'all'))
-        check_bool_option('interpoint_shortest_dist')
-        check_bool_option('interpoint_lateral_dist')
-        check_bool_dict_option('interpoint_relations')
-        check_bool_dict_option('outputs')
+        self.opt.read_config(self.configfn, warn=self.show_warning)
     
     def set_options_in_ui(self):
         self.SpatResSpinCtrl.SetValue(self.opt.spatial_resolution)
@@ -432,6 +341,14 @@ class Frame(gui.MainFrame):
         else:
             self.OutputFormatRadioBox.SetSetStringSelection(
                 'Tab-delimited text')
+        # Formats other than Excel and csv (e.g., 'npz' or 'sqlite') can only
+        # be set in the configuration file; such a format is kept unless
+        # another format is selected (see set_options_from_ui())
+        self.shown_output_format = self.OutputFormatRadioBox.GetStringSelection()
+        if self.opt.output_file_format not in ('excel', 'csv'):
+            self.StatusBar.SetStatusText("Output file format '%s' (from the configuration "
+                                         "file) is used unless another format is selected."
+                                         % self.opt.output_file_format)
         self.IfOutputExistsRadioBox.SetStringSelection(
             self.opt.action_if_output_file_exists.capitalize())
         self.DateSuffixCheckBox.SetValue(self.opt.output_filename_date_suffix)
@@ -452,7 +369,10 @@ class Frame(gui.MainFrame):
                 self.opt.outputs[key] = True
             else:
                 self.opt.outputs[key] = False
-        if self.OutputFormatRadioBox.GetStringSelection() == 'Excel':
+        if (self.opt.output_file_format not in ('excel', 'csv') and
+                self.OutputFormatRadioBox.GetStringSelection() == self.shown_output_format):
+            pass    # Keep the format from the configuration file
+        elif self.OutputFormatRadioBox.GetStringSelection() == 'Excel':
             self.opt.output_file_format = 'excel'
             self.opt.output_filename_ext = '.xlsx'
         elif self.OutputFormatRadioBox.GetStringSelection() == 'Comma-delimited text':
@@ -508,17 +428,18 @@ class Frame(gui.MainFrame):
         c = self.InputFileListCtrl.GetItemCount()
         n = 0
         fn = ""
+        exts = (self.opt.input_filename_ext, self.opt.preparsed_filename_ext)
         for fn in fli:
-            if (os.path.isfile(fn) and
-                    os.path.splitext(fn)[1] == self.opt.input_filename_ext):
+            if os.path.isfile(fn) and (file_io.split_input_ext(fn)[1] in exts or
+                                       file_io.is_archive(fn)):
                 self.InputFileListCtrl.InsertItem(c + n, os.path.basename(fn))
                 self.InputFileListCtrl.SetItem(c + n, 1, os.path.dirname(fn))
                 n += 1
             elif os.path.isdir(fn):
                 for fn2 in os.listdir(fn):
                     if (os.path.isfile(os.path.join(fn, fn2)) and
-                            os.path.splitext(fn2)[1] ==
-                            self.opt.input_filename_ext):
+                            (file_io.split_input_ext(fn2)[1] in exts or
+                             file_io.is_archive(fn2))):
                         self.InputFileListCtrl.InsertItem(c + n, fn2)
                         self.InputFileListCtrl.SetItem(c + n, 1, fn)
                         n += 1
@@ -526,11 +447,11 @@ class Frame(gui.MainFrame):
             self.InputFileListCtrl.SetColumnWidth(0, -1)
             self.InputFileListCtrl.SetColumnWidth(1, -1)
         elif os.path.isdir(fn):
-            self.show_warning("No files with '%s' extension found in folder(s)."
-                              % self.opt.input_filename_ext)
+            self.show_warning("No files with '%s' or '%s' extension, or archives, "
+                              "found in folder(s)." % exts)
         else:
-            self.show_warning("Input files must have a '%s' extension."
-                              % self.opt.input_filename_ext)
+            self.show_warning("Input files must have a '%s' or '%s' extension, "
+                              "or be archives." % exts)
 
     @staticmethod
     def set_input_file_list_ctrl_columns(parent):
@@ -599,9 +520,11 @@ class Frame(gui.MainFrame):
 
 
 class ProcessThread(threading.Thread):
-    def __init__(self, opt):
+    def __init__(self, opt, results=None):
         threading.Thread.__init__(self)
         self.opt = opt 
+        self.results = results              # of a session to re-export
+        self.session_results = None         # set by main.main_proc()
         self.process_queue = queue.Queue()
         self.error_queue = queue.Queue(1)
         self.opt.stop_requested = False
@@ -613,7 +536,10 @@ class ProcessThread(threading.Thread):
     # noinspection PyBroadException
     def run(self):
         try:
-            self.exitcode = main.main_proc(self)
+            if self.results is not None:
+                self.exitcode = main.reexport_proc(self, self.results)
+            else:
+                self.exitcode = main.main_proc(self)
         except:  # yes, I do want to catch everything
             exc_str = "".join(traceback.format_exception(*sys.exc_info()))
             self.error_queue.put(exc_str)
@@ -204,17 +204,22 @@ class Point(object):
                 seg0 = n
         return project, seg0
 
-    def lateral_dist(self, path):
+    def lateral_dist(self, path, center=None):
         """ Determine lateral distance to center of path. If
             distance > 1, the projection of the point is on the
-            extension of path.
+            extension of path. The center point of path and the
+            segment it projects on may be supplied as a tuple in
+            center, if already known.
         """
         subpath = SegmentedPath()
-        # need node only
-        foo, seg_path_center = \
-            path.center_point().project_on_path_or_endnode(path)
+        if center is None:
+            # need node only
+            path_center = path.center_point()
+            foo, seg_path_center = path_center.project_on_path_or_endnode(path)
+        else:
+            path_center, seg_path_center = center
         project, seg_project = self.project_on_path_or_endnode(path)
-        subpath.extend([project, path.center_point()])
+        subpath.extend([project, path_center])
         if seg_path_center < seg_project:
             subpath.reverse()
         for n in range(min(seg_path_center, seg_project) + 1,
@@ -335,9 +340,10 @@ class Point(object):
             mindist = -mindist
         return mindist
 
-    def lateral_dist_to_point(self, p2, border):
+    def lateral_dist_to_point(self, p2, border, perimeter=None):
         """ Determine lateral distance to a point p2 along profile
-            border. Assume profile border is a closed path.
+            border. Assume profile border is a closed path. The
+            perimeter of border may be supplied, if already known.
         """
         path = SegmentedPath()
         p2_project, p2_seg_project = p2.project_on_closed_path(border)
@@ -349,7 +355,9 @@ class Point(object):
                        max(p2_seg_project, seg_project)):
             path.insert(len(path) - 1, border[n])
         length = path.length()
-        return min(length, border.perimeter() - length)
+        if perimeter is None:
+            perimeter = border.perimeter()
+        return min(length, perimeter - length)
 
 # end of class Point
 
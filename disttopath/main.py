@@ -1,9 +1,16 @@
+import importlib.util
+import io
 import itertools
+import os
 import os.path
+import random
+import sys
+import threading
 import time
-from .core import *
+from . import core
 from . import geometry
 from . import file_io
+from . import timing
 from . import version
 from . import stringconv
 
@@ -12,6 +19,12 @@ from . import stringconv
 # Functions
 #
 
+class RowList(list):
+    """ A list of rows, which can be written to like a csv writer """
+    writerow = list.append
+    writerows = list.extend
+
+
 def evaluated_profile_li(profileli):
     """ Return a list of synapses which were parsed and evaluated 
         w/o errors so far  
@@ -19,133 +32,57 @@ def evaluated_profile_li(profileli):
     return [pro for pro in profileli if not pro.errflag]
 
 
-def save_output(profileli, opt):
-    """ Save a summary of results of evaluated profiles
-    """
-    def m(x, pixelwidth):
-        return geometry.to_metric_units(x, pixelwidth)
+class SummaryWriter:
+    """ Writes the summary output files of a session. The rows of each
+        profile are written when the profile is added, after which its
+        point data may be released (see core.Profile.release_data());
+        thus, not all profiles need to be held in memory until the end
+        of the session. The summaries that need data from all profiles
+        (the session summary and the interpoint distances) are written
+        when the writer is closed.
 
-    def na(x):
-        if x in (None, -1):
-            return "N/A"
-        else:
-            return x
+        Output files are opened when the first evaluated profile is
+        added, so nothing is written if no profile could be evaluated.
+        If opt.single_output_file is True, the summaries are instead
+        written to a single file when the writer is closed (see
+        file_io.SummaryContainer). If the output file format is 'sqlite',
+        the summaries are stored in a database (see
+        database.ResultDatabase).
 
-    def write_session_summary():
-        if not opt.outputs['session summary']:
-            return
-        with file_io.FileWriter("session.summary", opt) as f:
-            f.writerow(["%s version:" % version.title,
-                       "%s (Last modified %s %s, %s)" % ((version.version,) + version.date)])
-            f.writerow(["Number of evaluated profiles:", len(eval_proli)])
-            if err_fli:
-                f.writerow(["Number of non-evaluated profiles:", len(err_fli)])
-            f.writerow(["Metric unit:", eval_proli[0].metric_unit])
-            f.writerow(["Spatial resolution:", opt.spatial_resolution, 
-                        eval_proli[0].metric_unit])
-            if clean_fli:
-                f.writerow(["Input files processed cleanly:"])
-                f.writerows([[fn] for fn in clean_fli])
-            if nop_fli:
-                f.writerow(["Input files processed but which generated no particle distances:"])
-                f.writerows([[fn] for fn in nop_fli])
-            if warn_fli:
-                f.writerow(["Input files processed but which generated warnings "
-                            "(see log for details):"])
-                f.writerows([[fn] for fn in warn_fli])
-            if err_fli:
-                f.writerow(["Input files not processed or not included in summary "
-                            "(see log for details):"])
-                f.writerows([[fn] for fn in err_fli])
-
-    def write_profile_summary():
-        if not opt.outputs['profile summary']:
-            return
-        with file_io.FileWriter("profile summary", opt) as f:
-            f.writerow(["Path length",                       
-                        "Particles (total)",
-                        "Positive particles",
-                        "Positive shell particles",
-                        "Negative shell particles",
-                        "Shell particles positive or within %s %s of path"
-                        % (opt.spatial_resolution,
-                           eval_proli[0].metric_unit),
-                        "Particles within %s %s of path" 
-                        % (opt.spatial_resolution,
-                           eval_proli[0].metric_unit),
-                        "Profile id",
-                        "Input file",
-                        "Comment"])
-            f.writerows([[m(pro.path.length(), pro.pixelwidth), 
-                          len(pro.pli),
-                          len([p for p in pro.pli if p.dist_to_path >= 0]),
-                          len([p for p in pro.pli if p.is_within_shell
-                               and p.dist_to_path >= 0]),
-                          len([p for p in pro.pli if p.is_within_shell 
-                               and p.dist_to_path < 0]),
-                          len([p for p in pro.pli 
-                               if (p.is_within_shell 
-                                   and (p.dist_to_path >= 0))
-                               or p.is_associated_with_path]),
-                          len([p for p in pro.pli if p.is_associated_with_path]),
-                          pro.id,
-                          os.path.basename(pro.inputfn),
-                          pro.comment] for pro in eval_proli])
-                      
-    def write_point_summary(ptype):
-        if ptype == 'particle' and opt.outputs['particle summary']:
-            pli = 'pli'
-            pstr = 'particle'
-        elif ptype == 'random' and opt.outputs['random summary'] and opt.use_random:
-            pli = 'randomli'
-            pstr = 'point'
+        If opt.timing_summary is True, the time spent in each stage of
+        processing each profile (see timing) is written to a timing
+        summary when the writer is closed.
+    """
+    def __init__(self, opt):
+        self.opt = opt
+        self.opt.save_result = {'any_saved': False, 'any_err': False}
+        self.summaries = []
+        self.files = {}
+        self.db = None
+        self.db_failed = False
+        self.columnar = opt.output_file_format in file_io.COLUMNAR_FORMATS
+        if opt.single_output_file and opt.output_file_format != 'sqlite':
+            self.container = file_io.SummaryContainer("summaries", opt)
         else:
-            return
-        with file_io.FileWriter("%s.summary" % ptype, opt) as f:
-            f.writerow(["%s number (as appearing in input file)" % pstr.capitalize(),
-                        "Perpendicular distance to path", 
-                        "Lateral distance to center of path", 
-                        "Lateral distance to center of path / path radius",
-                        "Particle associated w/ path",
-                        "Path length",
-                        "Profile id",
-                        "Input file",
-                        "Comment"])
-            f.writerows([[n + 1,
-                          m(p.dist_to_path, pro.pixelwidth), 
-                          m(p.lateral_dist_path, pro.pixelwidth), 
-                          p.lateral_dist_path / (pro.path.length() / 2),
-                          stringconv.yes_or_no(p.is_associated_with_path),
-                          m(pro.path.length(), pro.pixelwidth),
-                          pro.id,
-                          os.path.basename(pro.inputfn), 
-                          pro.comment] for pro in eval_proli for n, p in
-                         enumerate(pro.__dict__[pli])])
-
-    def write_cluster_summary():
-        if not opt.determine_clusters:
-            return
-        with file_io.FileWriter("cluster.summary", opt) as f:
-            f.writerow(["Cluster number",
-                        "Number of particles in cluster",
-                        "Distance of centroid to path",
-                        "Distance to nearest cluster along path "
-                        "Path length",
-                        "Profile ID",
-                        "Input file",
-                        "Comment"])
-            f.writerows([[n + 1,
-                          len(c),
-                          m(c.dist_to_path, pro.pixelwidth),
-                          m(na(c.dist_to_nearest_cluster), pro.pixelwidth),
-                          pro.id,
-                          os.path.basename(pro.inputfn),
-                          pro.comment] for pro in eval_proli for n, c in
-                         enumerate(pro.clusterli)])
-
-    def write_interpoint_summaries():
+            self.container = None
+        self.metric_unit = None
+        self.n_evaluated = 0
+        self.clean_fli, self.warn_fli, self.err_fli, self.nop_fli = [], [], [], []
+        self.ip_rels, self.ip_prefixli = self.__interpoint_relations()
+        self.ip_cols = [[] for __ in self.ip_prefixli]
+        self.started = timing.now()
+        self.ended = None
+        self.timed = []
+        self.session_timings = {}
+
+    def __interpoint_relations(self):
+        """ Return the interpoint relations that are to be written to the
+            interpoint distance summary, and the prefixes of the
+            corresponding distance lists of a profile.
+        """
+        opt = self.opt
         if not opt.determine_interpoint_dists:
-            return
+            return {}, []
         ip_rels = dict([(key, val)
                         for key, val in opt.interpoint_relations.items()
                         if val and 'simulated' not in key])
@@ -155,118 +92,491 @@ def save_output(profileli, opt):
                     del ip_rels[key]
         if (len(ip_rels) == 0 or not
                 (opt.interpoint_shortest_dist or opt.interpoint_lateral_dist)):
-            return
-        table = []
-        if opt.interpoint_dist_mode == 'all':
-            s = "all distances"
-        else:
-            s = "nearest neighbour distances"
-        table.append(["Mode: " + s])
-        headerli = list(ip_rels.keys())
+            return {}, []
         prefixli = []
         for key, val in ip_rels.items():
             prefix = key[0] + key[key.index('- ') + 2] + '_'
             prefixli.append(prefix)
         if opt.interpoint_shortest_dist and opt.interpoint_lateral_dist:
-            headerli.extend(headerli)
             prefixli.extend([t + 'lat' for t in prefixli])
-        topheaderli = []
-        if opt.interpoint_shortest_dist:
-            topheaderli.append("Shortest distances")
-            if opt.interpoint_lateral_dist:
-                topheaderli.extend([""] * (len(ip_rels) - 1))
-        if opt.interpoint_lateral_dist:
-            topheaderli.append("Lateral distances along path")
-        table.extend([topheaderli, headerli])
-        cols = [[] for _ in prefixli]
-        for pro in eval_proli:
-            for n, li in enumerate([pro.__dict__[prefix + 'distli'] for prefix in prefixli]):
-                cols[n].extend([m(e, pro.pixelwidth) for e in li])
-        # transpose cols and append to table
-        table.extend(list(itertools.zip_longest(*cols, fillvalue="")))
-        with file_io.FileWriter("interpoint.distances", opt) as f:
-            f.writerows(table)
+        return ip_rels, prefixli
 
-    def write_mc_dist_to_path():
-        if not opt.run_monte_carlo:
-            return
-        table = [["Run %d" % (n + 1)
-                  for n in range(0, opt.monte_carlo_runs)]]
-        for pro in eval_proli:
-            table.extend(itertools.zip_longest(*[[m(p.dist_to_path, pro.pixelwidth)
-                                                  for p in li['pli']] for li in pro.mcli]))
-        with file_io.FileWriter("simulated.path.distances", opt) as f:
-            f.writerows(table)
-
-    def write_mc_ip_dists(dist_type):
+    def __open(self, main_name, header=None):
+        self.summaries.append(main_name)
+        if self.db is not None:
+            return None
+        fw = file_io.FileWriter(main_name, self.opt, self.container)
+        f = fw.open()
+        self.files[main_name] = (fw, f)
+        if header is not None:
+            f.writerows(header)
+        return f
+
+    def __close(self, main_name):
+        if main_name in self.files:
+            self.files.pop(main_name)[0].close()
+
+    def __mc_ip_types(self, dist_type):
+        """ Return the simulated interpoint relations for which distances
+            of type dist_type are written, and the corresponding file names
+        """
+        opt = self.opt
         if not (opt.run_monte_carlo and opt.determine_interpoint_dists):
-            return
-        for ip_type in [key for key, val in opt.interpoint_relations.items()
-                        if 'simulated' in key and val]:
-            if ((dist_type == 'shortest' and not opt.interpoint_shortest_dist) or
-                    (dist_type == 'lateral' and not opt.interpoint_lateral_dist)):
+            return []
+        if ((dist_type == 'shortest' and not opt.interpoint_shortest_dist) or
+                (dist_type == 'lateral' and not opt.interpoint_lateral_dist)):
+            return []
+        return [(ip_type, "%s.interpoint.%s.distance.summary"
+                 % (ip_type.replace(" ", ""), dist_type))
+                for ip_type, val in opt.interpoint_relations.items()
+                if 'simulated' in ip_type and val]
+
+    def __start(self, pro):
+        """ Open the output files and write their headers; pro is the
+            first evaluated profile
+        """
+        opt = self.opt
+        self.metric_unit = pro.metric_unit
+        if opt.output_file_format == 'sqlite':
+            from . import database
+            fn = database.database_filename(opt)
+            try:
+                self.db = database.ResultDatabase(fn)
+            except database.DatabaseError:
+                sys.stdout.write("Error: Unable to save to file '%s'\n" % fn)
+                opt.save_result['any_err'] = True
+                self.db_failed = True
                 return
-            if dist_type == 'lateral':
-                short_dist_type = 'lat'
+        if opt.outputs['session summary']:
+            if self.columnar:
+                self.__open("session.summary", [["Item", "Value", "Unit"]])
+            else:
+                self.__open("session.summary")
+        if opt.outputs['profile summary']:
+            self.__open("profile summary", [[
+                "Path length",
+                "Particles (total)",
+                "Positive particles",
+                "Positive shell particles",
+                "Negative shell particles",
+                "Shell particles positive or within %s %s of path"
+                % (opt.spatial_resolution, self.metric_unit),
+                "Particles within %s %s of path"
+                % (opt.spatial_resolution, self.metric_unit),
+                "Profile id",
+                "Input file",
+                "Comment"]])
+        for ptype in ('particle', 'random'):
+            if ptype == 'particle' and opt.outputs['particle summary']:
+                pstr = 'particle'
+            elif ptype == 'random' and opt.outputs['random summary'] and opt.use_random:
+                pstr = 'point'
             else:
-                short_dist_type = ''
-            table = [["Run %d" % (n + 1) for n in range(0, opt.monte_carlo_runs)]]
-            for pro in eval_proli:
-                table.extend(itertools.zip_longest(*[m(p, pro.pixelwidth)
-                                                     for li in pro.mcli
-                                                     for p in li[ip_type]["%sdist"
-                                                                          % short_dist_type]]))
-            with file_io.FileWriter("%s.interpoint.%s.distance.summary"
-                                    % (ip_type.replace(" ", ""), dist_type), opt) as f:
-                f.writerows(table)
-
-    def write_mc_cluster_summary():
-        if not (opt.determine_clusters and opt.run_monte_carlo):
+                continue
+            self.__open("%s.summary" % ptype, [[
+                "%s number (as appearing in input file)" % pstr.capitalize(),
+                "Perpendicular distance to path",
+                "Lateral distance to center of path",
+                "Lateral distance to center of path / path radius",
+                "Particle associated w/ path",
+                "Path length",
+                "Profile id",
+                "Input file",
+                "Comment"]])
+        if self.ip_prefixli:
+            self.__open("interpoint.distances")
+        if opt.determine_clusters:
+            self.__open("cluster.summary", [[
+                "Cluster number",
+                "Number of particles in cluster",
+                "Distance of centroid to path",
+                "Distance to nearest cluster along path "
+                "Path length",
+                "Profile ID",
+                "Input file",
+                "Comment"]])
+        if opt.run_monte_carlo:
+            self.__open("simulated.path.distances",
+                        [["Run %d" % (n + 1) for n in range(0, opt.monte_carlo_runs)]])
+        for dist_type in ('shortest', 'lateral'):
+            for ip_type, main_name in self.__mc_ip_types(dist_type):
+                self.__open(main_name,
+                            [["Run %d" % (n + 1) for n in range(0, opt.monte_carlo_runs)]])
+        if opt.determine_clusters and opt.run_monte_carlo:
+            self.__open("simulated.cluster.summary", [[
+                "N particles in cluster", "Run",
+                "Distance of centroid to path",
+                "Distance to nearest cluster along path "
+                "membrane",
+                "Profile ID",
+                "Input file",
+                "Comment"]])
+
+    def add_profile(self, pro):
+        """ Record the outcome of processing profile pro, and if it was
+            evaluated, write its rows to the output files
+        """
+        if self.opt.timing_summary:
+            # The timings are kept by reference, so that stages timed
+            # after the profile is added (i.e., saving it) are included
+            self.timed.append((pro.id, pro.inputfn, pro.timings))
+        if not (pro.errflag or pro.warnflag):
+            self.clean_fli.append(pro.inputfn)
+        if pro.warnflag:
+            self.warn_fli.append(pro.inputfn)
+        if pro.errflag:
+            self.err_fli.append(pro.inputfn)
+        if not pro.pli:
+            self.nop_fli.append(pro.inputfn)
+        if pro.errflag:
             return
-        table = [["N particles in cluster", "Run",
-                  "Distance of centroid to path",
-                  "Distance to nearest cluster along path "
-                  "membrane",
-                  "Profile ID",
-                  "Input file",
-                  "Comment"]]
-        for pro in eval_proli:
+        if self.n_evaluated == 0:
+            self.__start(pro)
+        self.n_evaluated += 1
+        if not self.db_failed:
+            self.__write_profile_rows(pro)
+
+    def __write_profile_rows(self, pro):
+        def m(x, pixelwidth):
+            return geometry.to_metric_units(x, pixelwidth)
+
+        def na(x):
+            if x in (None, -1):
+                return "N/A"
+            else:
+                return x
+
+        opt = self.opt
+        if self.db is not None:
+            files = dict((main_name, RowList()) for main_name in self.summaries)
+        else:
+            files = dict((main_name, f) for main_name, (fw, f) in self.files.items())
+        inputfn = file_io.display_name(pro.inputfn)
+        if "profile summary" in files:
+            files["profile summary"].writerow(list(pro.summary) +
+                                              [pro.id, inputfn, pro.comment])
+        for ptype in ('particle', 'random'):
+            if "%s.summary" % ptype in files:
+                files["%s.summary" % ptype].writerows([
+                    [n + 1,
+                     s.dist_to_path,
+                     s.lateral_dist_path,
+                     s.norm_lateral_dist_path,
+                     stringconv.yes_or_no(s.is_associated_with_path),
+                     pro.summary.path_length,
+                     pro.id,
+                     inputfn,
+                     pro.comment] for n, s in enumerate(pro.point_summaries[ptype])])
+        ip_distlis = [[m(e, pro.pixelwidth) for e in pro.__dict__[prefix + 'distli']]
+                      for prefix in self.ip_prefixli]
+        if self.db is None:
+            for col, li in zip(self.ip_cols, ip_distlis):
+                col.extend(li)
+        if "cluster.summary" in files:
+            files["cluster.summary"].writerows([
+                [n + 1,
+                 len(c),
+                 m(c.dist_to_path, pro.pixelwidth),
+                 m(na(c.dist_to_nearest_cluster), pro.pixelwidth),
+                 pro.id,
+                 inputfn,
+                 pro.comment] for n, c in enumerate(pro.clusterli)])
+        if "simulated.path.distances" in files:
+            files["simulated.path.distances"].writerows(
+                itertools.zip_longest(*[[m(p.dist_to_path, pro.pixelwidth)
+                                         for p in li['pli']] for li in pro.mcli]))
+        for dist_type, short_dist_type in (('shortest', ''), ('lateral', 'lat')):
+            for ip_type, main_name in self.__mc_ip_types(dist_type):
+                files[main_name].writerows(
+                    itertools.zip_longest(*[m(p, pro.pixelwidth)
+                                            for li in pro.mcli
+                                            for p in li[ip_type]["%sdist"
+                                                                 % short_dist_type]]))
+        if "simulated.cluster.summary" in files:
+            table = []
             for n in range(0, opt.monte_carlo_runs):
                 for c in pro.mcli[n]['clusterli']:
-                    table.append([len(c), n + 1,
+                    table.append([c.n_points, n + 1,
                                   m(c.dist_to_path, pro.pixelwidth),
                                   m(na(c.dist_to_nearest_cluster),
                                     pro.pixelwidth),
                                   pro.id,
-                                  os.path.basename(pro.inputfn),
+                                  inputfn,
                                   pro.comment])
-        with file_io.FileWriter("simulated.cluster.summary", opt) as f:
-            f.writerows(table)
-
-    sys.stdout.write("\nSaving summaries...\n")
-    opt.save_result = {'any_saved': False, 'any_err': False}
-    eval_proli = [profile for profile in profileli if not profile.errflag]
-    clean_fli = [profile.inputfn for profile in profileli
-                 if not (profile.errflag or profile.warnflag)]
-    warn_fli = [profile.inputfn for profile in profileli if profile.warnflag]
-    err_fli = [profile.inputfn for profile in profileli if profile.errflag]
-    nop_fli = [profile.inputfn for profile in profileli if not profile.pli]
-    write_session_summary()
-    write_profile_summary()
-    write_point_summary('particle')
-    write_point_summary('random')
-    write_interpoint_summaries()
-    write_cluster_summary()
-    write_mc_dist_to_path()
-    write_mc_ip_dists('shortest')
-    write_mc_ip_dists('lateral')
-    write_mc_cluster_summary()
-    if opt.save_result['any_err']:
-        sys.stdout.write("Note: One or more summaries could not be saved.\n")
-    if opt.save_result['any_saved']:
-        sys.stdout.write("Done.\n")
-    else:
-        sys.stdout.write("No summaries saved.\n")
+            files["simulated.cluster.summary"].writerows(table)
+        if self.db is not None:
+            self.__add_to_database(pro, files, ip_distlis)
+
+    def __add_to_database(self, pro, tables, ip_distlis):
+        """ Add the rows of the summaries of pro in tables, and its
+            interpoint distances in ip_distlis, to the database
+        """
+        from . import database
+        opt = self.opt
+        key = (pro.id, file_io.display_name(pro.inputfn))
+        self.db.add_profile(key, pro.comment)
+        for main_name in database.SUMMARY_TABLES:
+            if main_name in tables:
+                self.db.add_summary_rows(main_name, key, tables[main_name])
+        if "simulated.path.distances" in tables:
+            self.db.add_simulated_distances(key, tables["simulated.path.distances"])
+        for dist_type in ('shortest', 'lateral'):
+            for ip_type, main_name in self.__mc_ip_types(dist_type):
+                self.db.add_simulated_distances(key, tables[main_name], ip_type, dist_type)
+        # Relations and distance types as in the headers of the interpoint
+        # distance summary
+        ip_types = []
+        if opt.interpoint_shortest_dist:
+            ip_types.extend((rel, 'shortest') for rel in self.ip_rels)
+        if opt.interpoint_lateral_dist:
+            ip_types.extend((rel, 'lateral') for rel in self.ip_rels)
+        for (rel, dist_type), distli in zip(ip_types, ip_distlis):
+            self.db.add_interpoint_distances(key, rel, dist_type, distli)
+
+    def __write_session_summary(self):
+        opt = self.opt
+        if "session.summary" not in self.files:
+            return
+        f = self.files["session.summary"][1]
+        f.writerow(["%s version:" % version.title,
+                   "%s (Last modified %s %s, %s)" % ((version.version,) + version.date)])
+        f.writerow(["Number of evaluated profiles:", self.n_evaluated])
+        if self.err_fli:
+            f.writerow(["Number of non-evaluated profiles:", len(self.err_fli)])
+        f.writerow(["Metric unit:", self.metric_unit])
+        f.writerow(["Spatial resolution:", opt.spatial_resolution, self.metric_unit])
+        if self.clean_fli:
+            f.writerow(["Input files processed cleanly:"])
+            f.writerows([[fn] for fn in self.clean_fli])
+        if self.nop_fli:
+            f.writerow(["Input files processed but which generated no particle distances:"])
+            f.writerows([[fn] for fn in self.nop_fli])
+        if self.warn_fli:
+            f.writerow(["Input files processed but which generated warnings "
+                        "(see log for details):"])
+            f.writerows([[fn] for fn in self.warn_fli])
+        if self.err_fli:
+            f.writerow(["Input files not processed or not included in summary "
+                        "(see log for details):"])
+            f.writerows([[fn] for fn in self.err_fli])
+
+    def __write_interpoint_summaries(self):
+        opt = self.opt
+        if not self.ip_prefixli:
+            return
+        table = []
+        if opt.interpoint_dist_mode == 'all':
+            s = "all distances"
+        else:
+            s = "nearest neighbour distances"
+        table.append(["Mode: " + s])
+        headerli = list(self.ip_rels.keys())
+        if opt.interpoint_shortest_dist and opt.interpoint_lateral_dist:
+            headerli.extend(headerli)
+        topheaderli = []
+        if opt.interpoint_shortest_dist:
+            topheaderli.append("Shortest distances")
+            if opt.interpoint_lateral_dist:
+                topheaderli.extend([""] * (len(self.ip_rels) - 1))
+        if opt.interpoint_lateral_dist:
+            topheaderli.append("Lateral distances along path")
+        if self.columnar:
+            # Columnar files have a single row of column names
+            topli = []
+            if opt.interpoint_shortest_dist:
+                topli.extend(["Shortest distances"] * len(self.ip_rels))
+            if opt.interpoint_lateral_dist:
+                topli.extend(["Lateral distances along path"] * len(self.ip_rels))
+            table = [["%s (%s): %s" % (top, s, rel)
+                      for top, rel in zip(topli, headerli)]]
+        else:
+            table.extend([topheaderli, headerli])
+        # transpose cols and append to table
+        table.extend(list(itertools.zip_longest(*self.ip_cols, fillvalue="")))
+        self.files["interpoint.distances"][1].writerows(table)
+
+    def __stop_clock(self, started):
+        """ Record the time of saving the summaries, started at started,
+            and the end of the session
+        """
+        timing.add(self.session_timings, 'saving summaries', started)
+        self.ended = timing.now()
+
+    def __session_time(self):
+        return [self.ended[0] - self.started[0], self.ended[1] - self.started[1]]
+
+    def __write_timing_summary(self):
+        """ Write the wall and CPU time of each stage of processing each
+            profile, of saving the summaries and of the whole session
+        """
+        def r(t):
+            return round(t, 4)
+
+        stages = []
+        for __, __, timings in self.timed:
+            stages.extend(s for s in timings if s not in stages)
+        f = self.__open("timing.summary")
+        headerli = ["Profile id", "Input file"]
+        for s in stages:
+            headerli.extend(["%s wall time (s)" % (s[0].upper() + s[1:]),
+                             "%s CPU time (s)" % (s[0].upper() + s[1:])])
+        headerli.extend(["Total wall time (s)", "Total CPU time (s)"])
+        table = [headerli]
+        sums = {}
+        for pro_id, inputfn, timings in self.timed:
+            row = [pro_id if pro_id is not None else "N/A",
+                   file_io.display_name(inputfn)]
+            for s in stages:
+                if s not in timings:
+                    row.extend(["", ""])
+                    continue
+                row.extend(r(t) for t in timings[s])
+                t = sums.setdefault(s, [0.0, 0.0])
+                t[0] += timings[s][0]
+                t[1] += timings[s][1]
+            table.append(row + [r(t) for t in timing.total(timings)])
+        row = ["", "All profiles"]
+        for s in stages:
+            row.extend(r(t) for t in sums[s])
+        table.append(row + [r(t) for t in timing.total(sums)])
+        empty = [""] * (2 * len(stages))
+        table.append(["", "Saving summaries"] + empty +
+                     [r(t) for t in timing.total(self.session_timings)])
+        table.append(["", "Session"] + empty + [r(t) for t in self.__session_time()])
+        f.writerows(table)
+        self.__close("timing.summary")
+
+    def __add_timings_to_database(self):
+        """ Add the wall and CPU time of each stage of processing each
+            profile, and of saving the summaries, to the database
+        """
+        for pro_id, inputfn, timings in self.timed:
+            self.db.add_timings((pro_id, file_io.display_name(inputfn)), timings)
+        self.db.add_timings((None, None), self.session_timings)
+        self.db.add_timings((None, None), {'session': self.__session_time()})
+
+    def __close_database(self, started):
+        """ Record the session in the database and commit it; the
+            timings, if any, are added after the commit, so that it is
+            included in the time of saving the summaries (started at
+            started)
+        """
+        from . import database
+        opt = self.opt
+        statusli = []
+        if "session.summary" in self.summaries:
+            for fli, status in ((self.clean_fli, "clean"),
+                                (self.nop_fli, "no particle distances"),
+                                (self.warn_fli, "warnings"),
+                                (self.err_fli, "not processed")):
+                statusli.extend((file_io.display_name(fn), status) for fn in fli)
+        try:
+            self.db.add_session(version.version, self.metric_unit,
+                                opt.spatial_resolution, self.n_evaluated, statusli)
+            if opt.timing_summary:
+                self.db.commit()
+                self.__stop_clock(started)
+                self.__add_timings_to_database()
+            self.db.close()
+            sys.stdout.write("Saved '%s'.\n" % self.db.fn)
+            opt.save_result['any_saved'] = True
+        except database.DatabaseError:
+            sys.stdout.write("Error: Unable to save to file '%s'\n" % self.db.fn)
+            opt.save_result['any_err'] = True
+        self.db = None
+
+    def close(self):
+        """ Write the summaries that need data from all profiles, and
+            close the output files. The timing summary, if any, is written
+            last, once the other summaries are saved (except when in a
+            single file, which is written after it).
+        """
+        opt = self.opt
+        sys.stdout.write("\nSaving summaries...\n")
+        started = timing.now()
+        if self.db is not None:
+            self.__close_database(started)
+        elif self.n_evaluated > 0 and not self.db_failed:
+            self.__write_session_summary()
+            self.__write_interpoint_summaries()
+            for main_name in list(self.files):
+                self.__close(main_name)
+            if opt.timing_summary:
+                self.__stop_clock(started)
+                self.__write_timing_summary()
+        for main_name in list(self.files):
+            self.__close(main_name)
+        if self.container is not None:
+            self.container.close()
+        if opt.timing_summary and self.ended is not None:
+            wall, cpu = timing.now()
+            sys.stdout.write("Summaries saved in %.3f s (CPU time %.3f s).\n"
+                             % (wall - started[0], cpu - started[1]))
+        if opt.save_result['any_err']:
+            sys.stdout.write("Note: One or more summaries could not be saved.\n")
+        if opt.save_result['any_saved']:
+            sys.stdout.write("Done.\n")
+        else:
+            sys.stdout.write("No summaries saved.\n")
+
+    def discard(self):
+        """ Close and remove the output files written so far (e.g., when
+            the session is aborted)
+        """
+        for fw, f in self.files.values():
+            fw.discard()
+        self.files = {}
+        if self.container is not None:
+            self.container.discard()
+        if self.db is not None:
+            self.db.discard()
+            self.db = None
+
+
+def resolve_session_options(opt):
+    """ Resolve the options that must be the same for all profiles in a
+        session (metric unit, and whether polarity and random points
+        are used) from the first input file with a valid header. The
+        headers of all input files are scanned, and those that conflict
+        with the first one (and would thus not be processed) are
+        reported. Return a read-only snapshot of opt to be used while
+        processing.
+    """
+    header = None
+    first_fn = None
+    conflicts = []
+    for inputfn in opt.input_file_list:
+        file_header = core.scan_header(inputfn)
+        if file_header is None:
+            continue
+        if header is None:
+            header, first_fn = file_header, inputfn
+            continue
+        diffs = []
+        if file_header['metric_unit'] != header['metric_unit']:
+            diffs.append("metric unit '%s' (not '%s')"
+                         % (file_header['metric_unit'], header['metric_unit']))
+        for optstr, item in (('use_polarity', "polarity (POSLOC)"),
+                             ('use_random', "random points")):
+            if file_header[optstr] != header[optstr]:
+                diffs.append("%s %s" % (item, "found" if file_header[optstr]
+                                        else "not found"))
+        if diffs:
+            conflicts.append("  %s: %s\n" % (file_io.display_name(inputfn),
+                                              ", ".join(diffs)))
+    if conflicts:
+        sys.stdout.write("Warning: %s inconsistent with the first input file "
+                         "'%s' and will not be processed:\n%s"
+                         % ("This input file is" if len(conflicts) == 1
+                            else "These input files are",
+                            file_io.display_name(first_fn), "".join(conflicts)))
+    if header is None:
+        header = {'metric_unit': '', 'use_polarity': False, 'use_random': False}
+    for optstr, val in header.items():
+        if not hasattr(opt, optstr):
+            setattr(opt, optstr, val)
+    return core.FrozenOptionData(opt)
+
 
 def reset_options(opt):
     """ Deletes certain options that should always be set anew for each run
@@ -301,15 +611,41 @@ def show_options(opt):
     sys.stdout.write("Clusters determined: %s\n" % stringconv.yes_or_no(opt.determine_clusters))
     if opt.determine_clusters:
         sys.stdout.write("Within-cluster distance: %d\n" % opt.within_cluster_dist)
+    if opt.output_file_format == 'sqlite':
+        from . import database
+        sys.stdout.write("Results database: %s\n" % database.database_filename(opt))
+    elif opt.single_output_file:
+        sys.stdout.write("All summaries saved to a single file: yes\n")
+    if opt.cache_dir:
+        sys.stdout.write("Result cache: %s\n" % opt.cache_dir)
+    if opt.save_preparsed_profiles:
+        sys.stdout.write("Pre-parsed profiles saved: yes\n")
+    if opt.results_file:
+        sys.stdout.write("Session results saved to: %s\n" % opt.results_file)
+    if opt.timing_summary:
+        sys.stdout.write("Timing summary saved: yes\n")
+    if opt.trace_file:
+        sys.stdout.write("Trace saved to: %s\n" % opt.trace_file)
+    if opt.processes != 1:
+        sys.stdout.write("Parallel processes: %s\n"
+                         % (opt.processes if opt.processes > 0 else "all available"))
 
 
 def get_output_format(opt):
     if opt.output_file_format == 'excel':
-        try:
-            import openpyxl
-        except ImportError:
+        # Only check that openpyxl is available; it is not imported until
+        # an Excel file is actually written
+        if importlib.util.find_spec('openpyxl') is None:
             sys.stdout.write("Unable to write Excel files: resorting to csv format.\n")
             opt.output_file_format = 'csv'
+    if opt.output_file_format == 'feather':
+        if importlib.util.find_spec('pyarrow') is None:
+            sys.stdout.write("Unable to write Feather files: resorting to npz format.\n")
+            opt.output_file_format = 'npz'
+    if opt.output_file_format in file_io.COLUMNAR_FORMATS:
+        opt.output_filename_ext = '.' + opt.output_file_format
+    if opt.output_file_format == 'sqlite':
+        opt.output_filename_ext = '.sqlite'
     if opt.output_file_format == 'csv':
         opt.output_filename_ext = '.csv'
         opt.csv_format = {'dialect': 'excel', 'lineterminator': '\n'}
@@ -322,6 +658,213 @@ def get_output_format(opt):
         opt.output_filename_suffix += "." + opt.output_filename_other_suffix
       
 
+def get_session_results(opt):
+    """ Return the store in which the processed profiles of the session
+        are kept for re-export, or None if they are not kept. The profiles
+        are written to opt.results_file, or if opt.keep_session_results is
+        True, to a temporary results file, so that they need not be held
+        in memory.
+    """
+    if not (opt.keep_session_results or opt.results_file):
+        return None
+    from . import results
+    try:
+        if opt.results_file:
+            return results.SessionResults(opt, opt.results_file)
+        return results.SessionResults(opt, temporary=True)
+    except IOError:
+        sys.stdout.write("Unable to write results file '%s': session results "
+                         "not saved.\n" % (opt.results_file or "(temporary)"))
+        return None
+
+
+def get_trace(opt):
+    """ Return the trace of the session, or None if it is not traced """
+    if not opt.trace_file:
+        return None
+    return timing.Trace(opt.trace_file)
+
+
+def save_trace(trace):
+    """ Write the trace of the session to its trace file """
+    try:
+        trace.close()
+        sys.stdout.write("Saved trace to '%s'.\n" % trace.fn)
+    except IOError:
+        sys.stdout.write("Error: Unable to save to file '%s'\n" % trace.fn)
+
+
+def get_result_cache(opt):
+    """ Return the result cache to use, or None if caching is disabled
+        or the cache directory is unusable.
+    """
+    if not opt.cache_dir:
+        return None
+    from . import cache
+    try:
+        return cache.ResultCache(opt.cache_dir, opt.cache_max_size)
+    except OSError:
+        sys.stdout.write("Unable to use result cache directory '%s': caching "
+                         "disabled.\n" % opt.cache_dir)
+        return None
+
+
+def process_or_load(inputfn, opt, cache=None):
+    """ Return the profile in inputfn processed with options opt; if
+        it is in cache, use the cached profile instead of processing it.
+    """
+    started = timing.now()
+    key = cache.key(inputfn, opt) if cache is not None else None
+    if key is not None:
+        pro = cache.get(key)
+        if pro is not None:
+            sys.stdout.write("\nUsing cached results for '%s'.\n" % inputfn)
+            pro.inputfn = inputfn
+            pro.opt = opt
+            # Only the time taken to look up the profile is relevant
+            pro.timings = {}
+            pro.trace_events = [] if opt.trace_file else None
+            timing.add(pro.timings, 'cache', started, pro.trace_events)
+            trace_profile(pro, started)
+            return pro
+    pro = core.Profile(inputfn, opt)
+    if key is not None:
+        timing.add(pro.timings, 'cache', started, pro.trace_events)
+    pro.process(opt)
+    if key is not None and not (pro.errflag or opt.stop_requested):
+        with timing.stage(pro.timings, 'cache', pro.trace_events):
+            cache.put(key, pro)
+    trace_profile(pro, started)
+    return pro
+
+
+def trace_profile(pro, started):
+    """ Record the processing of pro, started at started (as returned by
+        timing.now()), as a span in its trace events, if traced
+    """
+    if pro.trace_events is not None:
+        timing.event(pro.trace_events, file_io.display_name(pro.inputfn),
+                     'profile', started[0])
+
+
+def process_serially(parent, fnli, opt, cache=None):
+    """ Process the profiles in fnli one after another; yield each
+        profile once processed. The next opt.prefetch_depth input files
+        are read ahead while a profile is processed.
+    """
+    if opt.prefetch_depth > 0:
+        prefetcher = file_io.Prefetcher(fnli, opt.prefetch_depth)
+        fnli = prefetcher
+    else:
+        prefetcher = None
+    try:
+        for inputfn in fnli:
+            parent.process_queue.put(('new_file', inputfn))
+            yield process_or_load(inputfn, opt, cache)
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
+
+
+# Set in each worker process by init_worker()
+_stop_event = None
+
+
+def init_worker(stop_event):
+    """ Initialize a worker process of a parallel session
+    """
+    global _stop_event
+    _stop_event = stop_event
+    # Otherwise, forked workers would all simulate the same points
+    random.seed()
+
+
+def process_profile(inputfn, opt, cache=None):
+    """ Process a single profile in a worker process. Return the
+        profile and the log output generated while processing it.
+    """
+
+    def watch_stop_event():
+        while not done.is_set():
+            if _stop_event.wait(0.2):
+                opt.stop_requested = True
+                return
+
+    done = threading.Event()
+    watcher = threading.Thread(target=watch_stop_event, daemon=True)
+    watcher.start()
+    stdout = sys.stdout
+    sys.stdout = log = io.StringIO()
+    try:
+        pro = process_or_load(inputfn, opt, cache)
+    finally:
+        sys.stdout = stdout
+        done.set()
+    return pro, log.getvalue()
+
+
+def process_in_parallel(parent, fnli, opt, cache=None):
+    """ Process the profiles in fnli in a pool of opt.processes worker
+        processes; yield each profile, in input order, once processed.
+        The log output of each profile is written when it is yielded.
+        Likewise, 'new_file' is posted to the process queue of parent
+        when the result of a profile is waited for, not when a worker
+        starts processing it, so progress is reported in input order.
+    """
+    import concurrent.futures
+    import multiprocessing
+    processes = opt.processes if opt.processes > 0 else os.cpu_count()
+    stop_event = multiprocessing.Event()
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=processes,
+                                                      initializer=init_worker,
+                                                      initargs=(stop_event,))
+    try:
+        futures = [executor.submit(process_profile, inputfn, opt, cache) for inputfn in fnli]
+        for inputfn, future in zip(fnli, futures):
+            parent.process_queue.put(('new_file', inputfn))
+            while True:
+                if opt.stop_requested:
+                    stop_event.set()
+                try:
+                    pro, log = future.result(timeout=0.2)
+                    break
+                except concurrent.futures.TimeoutError:
+                    continue
+            pro.opt = opt
+            sys.stdout.write(log)
+            yield pro
+    finally:
+        # However the session ended (finished, stopped, or interrupted
+        # by an exception such as KeyboardInterrupt before stop_requested
+        # could be set), tell the workers to stop, so that shutting down
+        # does not wait for the profiles being processed
+        stop_event.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def expand_archives(fnli, opt):
+    """ Return the input file list fnli with each archive replaced by
+        those of its members that are input files.
+    """
+    exts = (opt.input_filename_ext, opt.preparsed_filename_ext)
+    expanded = []
+    for fn in fnli:
+        if not file_io.is_archive(fn):
+            expanded.append(fn)
+            continue
+        try:
+            members = file_io.list_archive(fn, exts)
+        except IOError:
+            # Keep the archive, so that it is reported as an input file
+            # that could not be read
+            expanded.append(fn)
+            continue
+        if not members:
+            sys.stdout.write("No input files found in archive '%s'.\n" % fn)
+        expanded.extend(members)
+    return expanded
+
+
 def main_proc(parent):
     """ Process profile data files
     """
@@ -329,9 +872,9 @@ def main_proc(parent):
     if not opt.input_file_list:
         sys.stdout.write("No input files.\n")
         return 0                 
-    i, n = 0, 0
     profileli = []
     sys.stdout.write("--- Session started %s local time ---\n" % time.ctime())
+    opt.input_file_list = expand_archives(opt.input_file_list, opt)
     # Remove duplicate filenames
     for f in opt.input_file_list:
         if opt.input_file_list.count(f) > 1:
@@ -341,30 +884,108 @@ def main_proc(parent):
     get_output_format(opt)
     reset_options(opt)
     show_options(opt)
-    while True:
-        if i < len(opt.input_file_list):
-            inputfn = opt.input_file_list[i]
-            i += 1
-        else: 
-            sys.stdout.write("\nNo more input files...\n")
-            break
-        parent.process_queue.put(('new_file', inputfn))
-        profileli.append(Profile(inputfn, opt))
-        profileli[-1].process(opt)
+    session_opt = resolve_session_options(opt)
+    cache = get_result_cache(opt)
+    results = get_session_results(opt)
+    trace = get_trace(opt)
+    writer = SummaryWriter(opt)
+    if opt.processes != 1 and len(opt.input_file_list) > 1:
+        profile_iter = process_in_parallel(parent, opt.input_file_list, session_opt, cache)
+    else:
+        profile_iter = process_serially(parent, opt.input_file_list, session_opt, cache)
+    for pro in profile_iter:
+        profileli.append(pro)
         if opt.stop_requested:
-            sys.stdout.write("\n--- Session aborted by user %s local time ---\n" 
+            profile_iter.close()
+            file_io.close_archive()
+            writer.discard()
+            if results is not None:
+                results.discard()
+            sys.stdout.write("\n--- Session aborted by user %s local time ---\n"
                              % time.ctime())
-            return 3                    
-        if not profileli[-1].errflag:
-            n += 1
-            if profileli[-1].warnflag:
+            return 3
+        trace_events = None
+        if trace is not None:
+            # Merge the events of the profile (which may have been
+            # recorded in a worker process) into the trace
+            trace.add_events(pro.trace_events or [])
+            pro.trace_events = None
+            trace_events = trace.events
+        if not pro.errflag:
+            if pro.warnflag:
                 sys.stdout.write("Warning(s) found while processing input file.\n")
-                continue
         else:
             sys.stdout.write("Error(s) found while processing input file =>\n"
                              "  => No distances could be determined.\n")
-            continue
-    # no more input files
+        # Write the results of the profile, after which they are no
+        # longer needed (unless kept in memory for re-export)
+        with timing.stage(pro.timings, 'save', trace_events):
+            writer.add_profile(pro)
+            if results is not None:
+                results.add(pro)
+        if results is None or not results.in_memory:
+            pro.release_data()
+    sys.stdout.write("\nNo more input files...\n")
+    file_io.close_archive()
+    if cache is not None:
+        cache.evict()
+    if results is not None:
+        results.close()
+        if not (results.in_memory or results.temporary):
+            sys.stdout.write("Saved session results to '%s'.\n" % results.fn)
+        parent.session_results = results
+    return finish_session(parent, writer, profileli, trace)
+
+
+def reexport_proc(parent, results):
+    """ Save the summaries of a previous session, whose processed
+        profiles are in results (a results.SessionResults), with the
+        output options in parent.opt; the input files are not processed
+        again. Return the exit code of the session as finish_session()
+        does, or 4 if the results file could not be read.
+    """
+    opt = parent.opt
+    sys.stdout.write("--- Re-export of session results started %s local time ---\n"
+                     % time.ctime())
+    reset_options(opt)
+    results.restore_options(opt)
+    get_output_format(opt)
+    show_options(opt)
+    trace = get_trace(opt)
+    writer = SummaryWriter(opt)
+    profileli = []
+    try:
+        for pro in results.profiles(opt):
+            parent.process_queue.put(('new_file', pro.inputfn))
+            if opt.stop_requested:
+                writer.discard()
+                sys.stdout.write("\n--- Session aborted by user %s local time ---\n"
+                                 % time.ctime())
+                return 3
+            profileli.append(pro)
+            # Only the time taken to save the profile again is relevant
+            pro.timings = {}
+            with timing.stage(pro.timings, 'save',
+                              trace.events if trace is not None else None):
+                writer.add_profile(pro)
+            if not results.in_memory:
+                pro.release_data()
+    except ValueError as err:
+        writer.discard()
+        sys.stdout.write("Error: Unable to read results file '%s': %s.\n"
+                         % (results.fn, err))
+        sys.stdout.write("--- Session ended %s local time ---\n" % time.ctime())
+        parent.process_queue.put(("done", ""))
+        return 4
+    return finish_session(parent, writer, profileli, trace)
+
+
+def finish_session(parent, writer, profileli, trace=None):
+    """ Report the input files with errors or warnings, save the
+        summaries (and the trace of the session, if any) and end the
+        session; return the exit code of the session
+    """
+    n = len(evaluated_profile_li(profileli))
     errfli = [pro.inputfn for pro in profileli if pro.errflag]
     warnfli = [pro.inputfn for pro in profileli if pro.warnflag]
     if errfli:
@@ -379,9 +1000,14 @@ def main_proc(parent):
         sys.stdout.write("%s\n" % "\n".join([fn for fn in warnfli]))
     if n > 0:
         parent.process_queue.put(("saving_summaries", ""))
-        save_output(profileli, opt)        
+        with timing.span(trace.events if trace is not None else None,
+                         "saving summaries", 'save'):
+            writer.close()
     else:
         sys.stdout.write("\nNo files processed.\n")
+    if trace is not None:
+        timing.event(trace.events, "session", 'session', trace.origin)
+        save_trace(trace)
     sys.stdout.write("--- Session ended %s local time ---\n" % time.ctime())
     parent.process_queue.put(("done", ""))
     if errfli: 
@@ -0,0 +1,163 @@
+#
+#    Stored results of a session:
+#
+#    Keeps the processed profiles of a session, so that its summaries can
+#    be saved again with other output options (re-exported) without
+#    processing the input files again. The profiles are either kept in
+#    memory, or written to a results file as they are added, from which
+#    they are read back one at a time when re-exported. A results file
+#    may be temporary (e.g., to keep the last session in the graphical
+#    user interface), in which case it is removed when no longer needed.
+#
+#    A results file is a sequence of pickles: a header with the options
+#    of the session, the profiles, and None to mark the end.
+
+import copy
+import os
+import os.path
+import pickle
+import tempfile
+from . import cache
+from . import file_io
+from . import version
+
+RESULTS_FILENAME_EXT = '.dtpr'
+RESULTS_FORMAT = 1
+
+# Options that are resolved from the input files at the start of a
+# session (see main.resolve_session_options()); they are restored on
+# re-export, but not compared
+SESSION_OPTIONS = ('metric_unit', 'use_polarity', 'use_random')
+
+
+def input_mtime(inputfn):
+    """ Return the modification time of input file inputfn (or of the
+        archive that it is a member of), or None if it cannot be read
+    """
+    try:
+        return os.path.getmtime(file_io.split_member(inputfn)[0])
+    except OSError:
+        return None
+
+
+class SessionResults:
+    """ The processed profiles of the session with options opt; kept in
+        memory, or, if fn is given, in the results file fn, or if
+        temporary is True, in a temporary results file
+    """
+    def __init__(self, opt, fn=None, temporary=False):
+        self.options = dict((optstr, copy.deepcopy(getattr(opt, optstr)))
+                            for optstr in cache.ANALYSIS_OPTIONS if hasattr(opt, optstr))
+        self.input_file_list = list(opt.input_file_list)
+        self.mtimes = [input_mtime(inputfn) for inputfn in self.input_file_list]
+        if temporary:
+            fd, fn = tempfile.mkstemp(suffix=RESULTS_FILENAME_EXT, prefix='disttopath-')
+            os.close(fd)
+        self.fn = fn
+        self.temporary = temporary
+        self.profileli = []
+        self.f = None
+        if fn is not None:
+            self.f = open(fn, 'wb')
+            pickle.dump({'format': RESULTS_FORMAT,
+                         'version': version.version,
+                         'options': self.options,
+                         'input_file_list': self.input_file_list,
+                         'mtimes': self.mtimes}, self.f, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, fn):
+        """ Return the results in the results file fn; the profiles are
+            not read until iterated over (see profiles())
+        """
+        with open(fn, 'rb') as f:
+            try:
+                header = pickle.load(f)
+            except (EOFError, pickle.UnpicklingError, AttributeError, ImportError,
+                    IndexError, ValueError):
+                raise ValueError("not a results file")
+        if not isinstance(header, dict) or header.get('format') != RESULTS_FORMAT:
+            raise ValueError("not a results file, or one of an unsupported format")
+        self = cls.__new__(cls)
+        self.options = header['options']
+        self.input_file_list = header['input_file_list']
+        self.mtimes = header['mtimes']
+        self.fn = fn
+        self.temporary = False
+        self.profileli = []
+        self.f = None
+        return self
+
+    @property
+    def in_memory(self):
+        return self.fn is None
+
+    def add(self, pro):
+        """ Add the processed profile pro """
+        if self.f is not None:
+            pickle.dump(pro, self.f, pickle.HIGHEST_PROTOCOL)
+        else:
+            self.profileli.append(pro)
+
+    def close(self):
+        """ Finish the results file, if any """
+        if self.f is not None:
+            pickle.dump(None, self.f)
+            self.f.close()
+            self.f = None
+
+    def discard(self):
+        """ Discard the results, and remove the results file, if any """
+        self.profileli = []
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+            try:
+                os.remove(self.fn)
+            except OSError:
+                pass
+
+    def remove(self):
+        """ Remove the results file if it is temporary """
+        if self.temporary:
+            self.discard()
+            try:
+                os.remove(self.fn)
+            except OSError:
+                pass
+
+    def profiles(self, opt):
+        """ Yield the profiles, with their options set to opt if read
+            from a results file
+        """
+        if self.in_memory:
+            yield from self.profileli
+            return
+        with open(self.fn, 'rb') as f:
+            pickle.load(f)      # header
+            while True:
+                try:
+                    pro = pickle.load(f)
+                except (EOFError, pickle.UnpicklingError):
+                    raise ValueError("incomplete results file")
+                if pro is None:
+                    return
+                pro.opt = opt
+                yield pro
+
+    def matches(self, opt):
+        """ Return True if opt has the same input files and analysis options
+            as the session, and the input files have not been modified since
+        """
+        if list(opt.input_file_list) != self.input_file_list:
+            return False
+        for optstr, val in self.options.items():
+            if optstr not in SESSION_OPTIONS and getattr(opt, optstr, None) != val:
+                return False
+        return self.mtimes == [input_mtime(inputfn) for inputfn in self.input_file_list]
+
+    def restore_options(self, opt):
+        """ Set the input files and analysis options of the session in opt """
+        for optstr, val in self.options.items():
+            setattr(opt, optstr, copy.deepcopy(val))
+        opt.input_file_list = list(self.input_file_list)
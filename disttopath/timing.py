@@ -0,0 +1,121 @@
+#
+#    Timing of the stages of a session:
+#
+#    The wall time and CPU time spent in each stage of processing a
+#    profile (parsing, determining distances, Monte Carlo simulations,
+#    saving etc.) are added up in a dict of the profile, which maps the
+#    name of each stage to a [wall time, CPU time] pair in seconds. CPU
+#    time is that of the current thread, so that time spent in other
+#    threads (e.g., reading input files ahead) is not included.
+#
+#    The stages (and other spans of time, such as each Monte Carlo run)
+#    may also be recorded as events in a list, which are written to a
+#    trace file in the Chrome trace-event JSON format (see Trace) that can
+#    be opened in a trace viewer such as Perfetto or chrome://tracing.
+#    Each event is tagged with the process and thread that it occurred
+#    in, so that events recorded in worker processes, which are returned
+#    with the profile, can be merged into the trace of the session.
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+def now():
+    """ Return the current wall and thread CPU time """
+    return time.perf_counter(), time.thread_time()
+
+
+def event(events, name, cat, started, ended=None):
+    """ Append a complete event named name of category cat, which
+        started at wall time started (and ended at wall time ended, by
+        default now), to events
+    """
+    if ended is None:
+        ended = time.perf_counter()
+    events.append({'name': name,
+                   'cat': cat,
+                   'ph': 'X',
+                   'ts': started * 1e6,
+                   'dur': (ended - started) * 1e6,
+                   'pid': os.getpid(),
+                   'tid': threading.get_native_id()})
+
+
+def add(timings, stage, started, events=None):
+    """ Add the wall and CPU time since started (as returned by now())
+        to timings[stage]; if events is not None, also append the stage
+        to events
+    """
+    wall, cpu = now()
+    t = timings.setdefault(stage, [0.0, 0.0])
+    t[0] += wall - started[0]
+    t[1] += cpu - started[1]
+    if events is not None:
+        event(events, stage, 'stage', started[0], wall)
+
+
+@contextlib.contextmanager
+def stage(timings, name, events=None):
+    """ Add the wall and CPU time spent in the with block to timings[name]
+        (and if events is not None, append it to events)
+    """
+    started = now()
+    try:
+        yield
+    finally:
+        add(timings, name, started, events)
+
+
+@contextlib.contextmanager
+def span(events, name, cat):
+    """ Append the with block to events as an event named name of
+        category cat, unless events is None
+    """
+    if events is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        event(events, name, cat, started)
+
+
+def total(timings):
+    """ Return the total wall and CPU time in timings """
+    return [sum(t[0] for t in timings.values()), sum(t[1] for t in timings.values())]
+
+
+class Trace:
+    """ The trace events of a session, written to the trace file fn when
+        closed. Times in the trace are relative to when it was created.
+    """
+    def __init__(self, fn):
+        self.fn = fn
+        self.origin = time.perf_counter()
+        self.events = []
+
+    def add_events(self, events):
+        """ Add events recorded elsewhere (e.g., in a worker process) """
+        self.events.extend(events)
+
+    def close(self):
+        """ Write the trace file; raise IOError if unable to """
+        origin = self.origin * 1e6
+        traceli = []
+        pids = []
+        for ev in self.events:
+            ev = dict(ev, ts=round(ev['ts'] - origin, 3), dur=round(ev['dur'], 3))
+            traceli.append(ev)
+            if ev['pid'] not in pids:
+                pids.append(ev['pid'])
+        main_pid = os.getpid()
+        for pid in pids:
+            traceli.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                            'args': {'name': "Main process" if pid == main_pid
+                                             else "Worker process %d" % pid}})
+        with open(self.fn, 'w') as f:
+            json.dump({'traceEvents': traceli, 'displayTimeUnit': 'ms'}, f)
@@ -4,33 +4,89 @@
 #    Uses the openpyxl module to write to Excel sheets,
 #    in a manner similar to the csv module
 #
+#    The workbook is created in write-only mode, so that rows are
+#    streamed to a temporary file as they are written rather than held
+#    in memory cell by cell.
+#
 #    N.B. The writer object needs to be explicitly closed.
 
 from openpyxl import Workbook
 
+# Excel limits on sheet titles
+MAX_SHEET_TITLE_LEN = 31
+INVALID_SHEET_TITLE_CHARS = '[]:*?/\\'
 
-class Writer(object):
-    def __init__(self, filename, sheetname="Sheet1"):
-        self.wb = Workbook()
-        self.sheet = self.wb.active
-        self.sheet.title = sheetname
-        self.filename = filename
-        self.curr_row = 1
+# Abbreviations applied to sheet titles that are too long, so
+# that the titles of similar summaries (such as the shortest and lateral
+# interpoint distances between simulated points) stay distinguishable
+SHEET_TITLE_ABBREVIATIONS = (('simulated', 'sim'),
+                             ('particle', 'part'),
+                             ('interpoint', 'ip'),
+                             ('distances', 'dists'),
+                             ('distance', 'dist'),
+                             ('.summary', ''))
+
+
+class SheetWriter(object):
+    """ Writes rows to a single sheet of a workbook """
+    def __init__(self, sheet):
+        self.sheet = sheet
+
+    @staticmethod
+    def convert(element):
+        if isinstance(element, int):
+            return element
+        elif isinstance(element, float):
+            return float(element)
+        else:
+            return str(element) if element is not None else "None"
 
     def writerow(self, row):
-        for col, element in enumerate(row):
-            c = self.sheet.cell(row=self.curr_row, column=col+1)
-            if isinstance(element, int):
-                c.value = element
-            elif isinstance(element, float):
-                c.value = float(element)
-            else:
-                c.value = str(element) if element is not None else "None"
-        self.curr_row += 1
+        self.sheet.append([self.convert(element) for element in row])
 
     def writerows(self, rows):
         for r in rows:
             self.writerow(r)
 
     def close(self):
-        self.wb.save(self.filename)
\ No newline at end of file
+        pass    # Saved with the workbook
+
+
+class Writer(SheetWriter):
+    """ Writes rows to a workbook with a single sheet """
+    def __init__(self, filename, sheetname="Sheet1"):
+        self.wb = Workbook(write_only=True)
+        super().__init__(self.wb.create_sheet(title=sheetname))
+        self.filename = filename
+
+    def close(self):
+        self.wb.save(self.filename)
+
+
+class MultiSheetWriter(object):
+    """ A workbook with a sheet for each of a number of tables """
+    def __init__(self, filename):
+        self.wb = Workbook(write_only=True)
+        self.filename = filename
+        self.titles = set()
+
+    def add_sheet(self, name):
+        """ Add a sheet with a title based on name, and return a writer
+            for it. The title is abbreviated (or if still too long,
+            truncated) and made unique if needed.
+        """
+        title = ''.join(c for c in name if c not in INVALID_SHEET_TITLE_CHARS)
+        if len(title) > MAX_SHEET_TITLE_LEN:
+            for word, abbr in SHEET_TITLE_ABBREVIATIONS:
+                title = title.replace(word, abbr)
+        base, title = title, title[:MAX_SHEET_TITLE_LEN]
+        n = 1
+        while title.lower() in self.titles:
+            n += 1
+            suffix = "~%d" % n
+            title = base[:MAX_SHEET_TITLE_LEN - len(suffix)] + suffix
+        self.titles.add(title.lower())
+        return SheetWriter(self.wb.create_sheet(title=title))
+
+    def close(self):
+        self.wb.save(self.filename)
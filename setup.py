@@ -21,7 +21,7 @@ setup(
     packages=find_packages(),
     entry_points={
     'console_scripts':
-        ['DistToPath = DistToPath:main'],
+        ['DistToPath-cli = disttopath.cli:main'],
     'gui_scripts':
         ['DistToPath = DistToPath:main']
     },